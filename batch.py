@@ -0,0 +1,158 @@
+""" Plans many start and goal pairs against the same map in one call.
+
+    The obstacle index and the roadmap are built once, the queries that share a start are answered with a
+    single shortest path tree (`roadmap.Roadmap.query_many`) and the groups of queries can be spread over
+    a pool of processes that memory-map the same saved roadmap.
+"""
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from collision import ObstacleIndex
+from roadmap import Roadmap
+
+# planner names, as in environment.main
+PLANNERS = ("visibility_graph", "PRM")
+
+# roadmap of each worker process, set by _init_worker
+_worker = {}
+
+
+def build_roadmap(planner, obstacles, limits, index=None, **kwargs):
+    """ Builds the roadmap used by `plan_batch` for a planner name, kwargs go to `Roadmap.prm`"""
+    index = index if index is not None else ObstacleIndex(obstacles)
+    if planner == "visibility_graph":
+        return Roadmap.visibility(obstacles, limits, index=index)
+    if planner == "PRM":
+        return Roadmap.prm(obstacles, limits, index=index, **kwargs)
+    raise ValueError(f"Unknown planner for batch queries: {planner}, use one of {PLANNERS}")
+
+
+def group_by_start(starts):
+    """ Groups the queries with the same start point.
+
+    Returns:
+        list of (start point, array with the indices of the queries that start there), in order of first use.
+    """
+    unique, first, inverse = np.unique(starts, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(inverse, minlength=len(unique)))])
+    groups = [(unique[ii], order[bounds[ii]:bounds[ii + 1]]) for ii in range(len(unique))]
+    return [groups[ii] for ii in np.argsort(first, kind="stable")]
+
+
+def _solve(roadmap, groups, goals):
+    """ Answers a list of groups of queries, returns a list of (query, distance, path)"""
+    results = []
+    for start, queries in groups:
+        if len(queries) == 1:
+            # one goal, A* towards it is cheaper than the whole tree
+            answers = [roadmap.query(start, goals[queries[0]])]
+        else:
+            answers = roadmap.query_many(start, goals[queries])
+        results += [(int(query), distance, path) for query, (distance, path) in zip(queries, answers)]
+    return results
+
+
+def _init_worker(folder):
+    """ Loads the saved roadmap in the worker, memory-mapped so the processes share the same pages"""
+    _worker["roadmap"] = Roadmap.load(folder)
+
+
+def _solve_in_worker(groups, goals):
+    """ Task run by the workers, see `_solve`"""
+    return _solve(_worker["roadmap"], groups, goals)
+
+
+def iter_batch(starts, goals, roadmap, workers=1, groups_per_task=16):
+    """ Generator with the answer of each query, as (query, distance, path), as soon as it is found.
+
+    With several workers the answers come in the order the tasks finish, use the query index to match them.
+    See `plan_batch` for the parameters.
+    """
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    goals = np.asarray(goals, dtype=float).reshape(-1, 2)
+    groups = group_by_start(starts)
+    if workers == 1:
+        for first in range(0, len(groups), groups_per_task):
+            yield from _solve(roadmap, groups[first:first + groups_per_task], goals)
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        roadmap.save(folder)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(folder,)) as pool:
+            tasks = []
+            for first in range(0, len(groups), groups_per_task):
+                task_groups = groups[first:first + groups_per_task]
+                queries = np.concatenate([queries for _, queries in task_groups])
+                # only the goals of the task are sent, the query indices are mapped back to them
+                position = {query: ii for ii, query in enumerate(queries.tolist())}
+                local = [(start, np.array([position[query] for query in group.tolist()])) for start, group in task_groups]
+                tasks.append((queries, pool.submit(_solve_in_worker, local, goals[queries])))
+            futures = {task: queries for queries, task in tasks}
+            for task in as_completed(futures):
+                queries = futures[task]
+                for local_query, distance, path in task.result():
+                    yield int(queries[local_query]), distance, path
+
+
+def plan_batch(starts, goals, obstacles=None, limits=None, planner="visibility_graph", roadmap=None, workers=1,
+               stream=False, **kwargs):
+    """ Shortest paths for many start and goal pairs on the same map.
+
+    Parameters:
+        starts, goals (array): (Q, 2) arrays with the start and goal point of each query.
+        obstacles, limits: the map, only needed when no roadmap is given.
+        planner (str): "visibility_graph" or "PRM", the roadmap built when none is given.
+        roadmap (Roadmap): prebuilt roadmap of the map, to reuse it across batches.
+        workers (int): number of processes, None for one per CPU. The roadmap is saved to a temporary
+                       folder and memory-mapped by every worker.
+        stream (bool): return the `iter_batch` generator instead of waiting for all the queries.
+        kwargs: passed to `Roadmap.prm` when the PRM roadmap is built here.
+
+    Returns:
+        distances: (Q,) array with the length of each path, inf where there is no path.
+        waypoints: (W, 2) array with the points of all the paths one after the other.
+        offsets: (Q + 1,) array, the path of query q is waypoints[offsets[q]:offsets[q + 1]] (empty if no path).
+    """
+    if roadmap is None:
+        roadmap = build_roadmap(planner, obstacles, limits, **kwargs)
+    results = iter_batch(starts, goals, roadmap, workers)
+    if stream:
+        return results
+
+    n_queries = len(np.asarray(starts).reshape(-1, 2))
+    distances = np.full(n_queries, np.inf)
+    paths = [[] for _ in range(n_queries)]
+    for query, distance, path in results:
+        distances[query] = distance
+        paths[query] = path
+    offsets = np.concatenate([[0], np.cumsum([len(path) for path in paths])]).astype(np.int64)
+    waypoints = np.array([point for path in paths for point in path], dtype=float).reshape(-1, 2)
+    return distances, waypoints, offsets
+
+
+def main():
+    # the example maps of the benchmarks, imported here so the module does not depend on them
+    from benchmarks.environments import random_environment, random_free_points
+
+    obstacles, limits = random_environment(50, seed=0)
+    points = random_free_points(2000, obstacles, limits, seed=1)
+    # a few depots as starts, so that many queries share the same start
+    starts = points[np.arange(1000) % 10]
+    goals = points[1000:]
+    for planner in PLANNERS:
+        roadmap = build_roadmap(planner, obstacles, limits, n_samples=2000, seed=0) if planner == "PRM" else \
+            build_roadmap(planner, obstacles, limits)
+        start = time.perf_counter()
+        distances, waypoints, offsets = plan_batch(starts, goals, roadmap=roadmap)
+        elapsed = time.perf_counter() - start
+        print(f"{planner}: {len(goals)} queries in {elapsed:.3f} s, {np.isfinite(distances).sum()} paths found, "
+              f"mean length {distances[np.isfinite(distances)].mean():.2f}")
+
+
+if __name__ == "__main__":
+    main()
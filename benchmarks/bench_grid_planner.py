@@ -0,0 +1,45 @@
+""" Compares the occupancy grid planners with the visibility graph at increasing grid resolutions.
+
+    The grid paths go through cell centers with 8-connected moves, so they are a few percent longer than the
+    exact shortest path of the visibility graph, less so as the cells get smaller.
+    Run from the root of the repository with: python -m benchmarks.bench_grid_planner
+"""
+import time
+
+from benchmarks.environments import random_environment, random_free_points
+from collision import ObstacleIndex
+from dijkstra import dijkstra
+from grid_planner import OccupancyGrid
+from visibility_graph import visibility_graph
+
+
+def main(n_obstacles=50):
+    obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+    p0, pf = (tuple(point) for point in random_free_points(2, obstacles, limits, seed=2).tolist())
+    index = ObstacleIndex(obstacles)
+
+    start = time.perf_counter()
+    graph = visibility_graph(p0, pf, obstacles, limits, index=index)
+    distance, _ = dijkstra(graph, p0, pf)
+    t_visibility = time.perf_counter() - start
+    optimal = distance[pf]
+    print(f"visibility graph: {t_visibility:.3f} s, length {optimal:.3f}")
+
+    print(f"{'resolution':>11} {'cells':>9} {'raster [s]':>11} {'A* [s]':>8} {'JPS [s]':>8} {'length ratio':>13}")
+    for resolution in (0.2, 0.1, 0.05, 0.02, 0.01):
+        start = time.perf_counter()
+        grid = OccupancyGrid.from_obstacles(obstacles, limits, resolution, index=index)
+        t_raster = time.perf_counter() - start
+        start = time.perf_counter()
+        d_astar, _ = grid.plan(p0, pf, method="astar")
+        t_astar = time.perf_counter() - start
+        start = time.perf_counter()
+        d_jps, _ = grid.plan(p0, pf, method="jps")
+        t_jps = time.perf_counter() - start
+        assert abs(d_astar - d_jps) < 1e-6 * max(d_jps, 1)
+        print(f"{resolution:>11} {grid.grid.size:>9} {t_raster:>11.3f} {t_astar:>8.3f} {t_jps:>8.3f} "
+              f"{d_jps / optimal:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
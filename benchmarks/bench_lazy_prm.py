@@ -0,0 +1,50 @@
+""" Build and query time of the lazy PRM roadmap compared to the one that checks every edge while building.
+
+    The queries run twice: the first pass checks the edges of the paths it finds, the second pass reuses
+    their status. The last column is the fraction of the roadmap edges that the lazy roadmap checked.
+    Run from the root of the repository with: python -m benchmarks.bench_lazy_prm
+"""
+import time
+
+import numpy as np
+
+from benchmarks.environments import random_environment, random_free_points
+from collision import ObstacleIndex
+from roadmap import UNKNOWN, Roadmap
+
+
+def timed_queries(roadmap, points):
+    """ Runs a query for each pair of points, returns the total time and the distances"""
+    start = time.perf_counter()
+    distances = [roadmap.query(points[ii], points[ii + 1])[0] for ii in range(0, len(points), 2)]
+    return time.perf_counter() - start, distances
+
+
+def main(n_queries=20):
+    print(f"{'obstacles':>10} {'samples':>8} {'connect':>12} {'build eager/lazy [s]':>21} "
+          f"{'queries eager/lazy/again [s]':>29} {'same':>5} {'checked':>8}")
+    for n_obstacles, n_samples, kwargs in ((50, 2000, {"k": 8}), (500, 20000, {"k": 8}),
+                                           (500, 20000, {"radius": "auto"}), (2000, 100000, {"radius": "auto"})):
+        obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+        index = ObstacleIndex(obstacles)
+        points = [tuple(point) for point in random_free_points(2 * n_queries, obstacles, limits, seed=1).tolist()]
+
+        start = time.perf_counter()
+        eager = Roadmap.prm(obstacles, limits, n_samples=n_samples, seed=0, index=index, **kwargs)
+        t_eager = time.perf_counter() - start
+        start = time.perf_counter()
+        lazy = Roadmap.prm(obstacles, limits, n_samples=n_samples, seed=0, index=index, lazy=True, **kwargs)
+        t_lazy = time.perf_counter() - start
+
+        q_eager, d_eager = timed_queries(eager, points)
+        q_lazy, d_lazy = timed_queries(lazy, points)
+        q_again, _ = timed_queries(lazy, points)
+        same = np.allclose(d_eager, d_lazy)
+        checked = np.mean(lazy.status != UNKNOWN)
+        connect = f"k={kwargs['k']}" if "k" in kwargs else "PRM* radius"
+        print(f"{n_obstacles:>10} {n_samples:>8} {connect:>12} {t_eager:>10.3f} /{t_lazy:>9.3f} "
+              f"{q_eager:>9.3f} /{q_lazy:>8.3f} /{q_again:>8.3f} {str(same):>5} {checked:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+""" Compares the collision query time of the brute force kernel and the grid index as the obstacle count grows.
+
+    Run from the root of the repository with: python -m benchmarks.bench_obstacle_index
+"""
+import time
+
+import numpy as np
+
+from benchmarks.environments import random_environment
+from collision import ObstacleIndex, pack_edges, segments_intersect
+
+
+def time_it(function, repeat=3):
+    """ Best wall time of a few runs, in seconds"""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_segments(limits, n_segments, segment_length, rng):
+    """ Segments with a random start, of the given length or, with None, ending anywhere in the workspace"""
+    start = rng.uniform(limits[0], limits[2], (n_segments, 2))
+    if segment_length is None:
+        return np.stack([start, rng.uniform(limits[0], limits[2], (n_segments, 2))], axis=1)
+    angle = rng.uniform(0, 2 * np.pi, n_segments)
+    end = start + segment_length * np.column_stack([np.cos(angle), np.sin(angle)])
+    return np.stack([start, end], axis=1)
+
+
+def main(n_segments=2000):
+    print(f"{'obstacles':>10} {'edges':>8} {'segments':>9} {'build [ms]':>11} {'brute [ms]':>11} {'index [ms]':>11} "
+          f"{'speedup':>8}")
+    for n_obstacles in (10, 100, 1000, 5000):
+        obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+        edges = pack_edges(obstacles)
+        t_build = time_it(lambda: ObstacleIndex(obstacles), repeat=1)
+        index = ObstacleIndex(obstacles)
+        # short segments like the PRM edges, and segments across the map like the visibility graph edges
+        for name, segment_length in (("short", 2.0), ("spanning", None)):
+            segments = random_segments(limits, n_segments, segment_length, np.random.default_rng(0))
+            assert np.array_equal(segments_intersect(segments, edges), index.segments_intersect(segments))
+            t_brute = time_it(lambda: segments_intersect(segments, edges))
+            t_index = time_it(lambda: index.segments_intersect(segments))
+            print(f"{n_obstacles:>10} {len(edges):>8} {name:>9} {1e3 * t_build:>11.2f} {1e3 * t_brute:>11.2f} "
+                  f"{1e3 * t_index:>11.2f} {t_brute / t_index:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+""" Scaling of the visibility graph construction with the number of worker processes.
+
+    Run from the root of the repository with: python -m benchmarks.bench_parallel
+"""
+import os
+import time
+
+from benchmarks.environments import random_environment
+from collision import ObstacleIndex
+from visibility_graph import visibility_graph
+
+
+def main():
+    print(f"{os.cpu_count()} CPUs available")
+    print(f"{'obstacles':>10} {'vertices':>9} {'workers':>8} {'time [s]':>9} {'speedup':>8} {'same':>5}")
+    for n_obstacles in (50, 100, 200):
+        obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+        p0, pf = (0.0, 0.0), tuple(float(c) for c in limits[2])
+        index = ObstacleIndex(obstacles)
+        serial, t_serial = None, None
+        for workers in (1, 2, 4, 8):
+            start = time.perf_counter()
+            graph = visibility_graph(p0, pf, obstacles, limits, index=index, workers=workers)
+            elapsed = time.perf_counter() - start
+            if serial is None:
+                serial, t_serial = graph, elapsed
+            print(f"{n_obstacles:>10} {len(graph):>9} {workers:>8} {elapsed:>9.3f} {t_serial / elapsed:>8.2f} "
+                  f"{str(graph == serial):>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+""" Latency of repairing the path with `dynamic_planner.DynamicPlanner` after an obstacle moves, compared to
+    building the roadmap again and searching it from scratch.
+
+    Run from the root of the repository with: python -m benchmarks.bench_replanning
+"""
+import time
+
+import numpy as np
+
+from benchmarks.environments import random_environment, random_free_points
+from dijkstra import dijkstra
+from dynamic_planner import DynamicPlanner
+from prm import PRM
+from visibility_graph import visibility_graph
+
+
+def rebuild(planner, p0, pf, obstacles, limits, n_samples):
+    """ Full rebuild with the static planners, as done before the dynamic planner"""
+    if planner == "PRM":
+        graph = PRM(p0, pf, obstacles, limits, n_samples=n_samples, k=8, seed=0)
+    else:
+        graph = visibility_graph(p0, pf, obstacles, limits)
+    dijkstra(graph, p0, pf)
+
+
+def main():
+    n_changes = 20
+    print(f"{'planner':>17} {'obstacles':>10} {'repair [ms]':>12} {'rebuild [ms]':>13} {'speedup':>8}")
+    for planner, n_obstacles, n_samples in (("PRM", 50, 2000), ("PRM", 200, 5000),
+                                            ("visibility_graph", 20, 0), ("visibility_graph", 50, 0)):
+        obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+        p0, pf = (tuple(point) for point in random_free_points(2, obstacles, limits, seed=1).tolist())
+        dynamic = DynamicPlanner(p0, pf, obstacles, limits, planner, n_samples=n_samples, seed=0)
+        dynamic.plan()
+        rng = np.random.default_rng(0)
+
+        repair, full = [], []
+        for _ in range(n_changes):
+            # move one obstacle a little
+            obstacle_id = rng.choice(list(dynamic.obstacles))
+            moved = np.array(dynamic.obstacles[obstacle_id]) + rng.uniform(-0.1, 0.1, 2)
+            start = time.perf_counter()
+            dynamic.move_obstacle(obstacle_id, tuple(map(tuple, moved.tolist())))
+            dynamic.plan()
+            repair.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            rebuild(planner, p0, pf, list(dynamic.obstacles.values()), limits, n_samples)
+            full.append(time.perf_counter() - start)
+
+        t_repair, t_full = 1000 * np.median(repair), 1000 * np.median(full)
+        print(f"{planner:>17} {n_obstacles:>10} {t_repair:>12.2f} {t_full:>13.2f} {t_full / t_repair:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+""" Accuracy and speed of the repulsive force backends of the potential field against the exact distance.
+
+    Run from the root of the repository with: python -m benchmarks.bench_repulsion
+"""
+import time
+
+import numpy as np
+
+from benchmarks.environments import random_environment, random_free_points
+from collision import pack_edges
+from potential_field import (SignedDistanceField, closest_points, repulsive_force, repulsive_force_exact,
+                             sample_obstacle_points)
+
+
+def sampled_distance(points, obs_points, chunk=256):
+    """ Distance from each point to the closest sampled obstacle point"""
+    return np.concatenate([
+        np.min(np.linalg.norm(points[start:start + chunk, np.newaxis] - obs_points[np.newaxis, :, :2], axis=2), axis=1)
+        for start in range(0, len(points), chunk)])
+
+
+def main(n_points=5000, threshold=0.5, sdf_resolution=0.02):
+    print(f"{'obstacles':>10} {'backend':>8} {'build [ms]':>11} {'query [ms]':>11} "
+          f"{'max dist err':>13} {'median force err':>17}")
+    for n_obstacles in (10, 100, 1000):
+        obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+        points = random_free_points(n_points, obstacles, limits, seed=1)
+        edges = pack_edges(obstacles)
+        exact_distance, _ = closest_points(points, edges)
+        exact_force = repulsive_force_exact(points, edges, threshold=threshold)
+        # the force is only defined close to the obstacles
+        near = (exact_distance < threshold) & (exact_distance > 0.05)
+
+        start = time.perf_counter()
+        obs_points = sample_obstacle_points(obstacles)
+        t_sampled_build = time.perf_counter() - start
+        start = time.perf_counter()
+        sdf = SignedDistanceField(obstacles, limits[0], limits[2], sdf_resolution)
+        t_sdf_build = time.perf_counter() - start
+
+        backends = {
+            "exact": (0.0, lambda p: repulsive_force_exact(p, edges, threshold=threshold),
+                      lambda p: closest_points(p, edges)[0]),
+            "sampled": (t_sampled_build, lambda p: repulsive_force(p, obs_points, threshold=threshold),
+                        lambda p: sampled_distance(p, obs_points)),
+            "sdf": (t_sdf_build, lambda p: sdf.repulsive_force(p, threshold=threshold), sdf),
+        }
+        for name, (t_build, force, distance) in backends.items():
+            start = time.perf_counter()
+            f = force(points)
+            t_query = time.perf_counter() - start
+            distance_error = np.max(np.abs(distance(points) - exact_distance))
+            force_error = np.median(np.linalg.norm(f[near] - exact_force[near], axis=1) /
+                                    np.linalg.norm(exact_force[near], axis=1))
+            print(f"{n_obstacles:>10} {name:>8} {1e3 * t_build:>11.1f} {1e3 * t_query:>11.1f} "
+                  f"{distance_error:>13.4f} {force_error:>17.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+""" Waypoints, length and time of `path_smoothing.postprocess` on the paths of each planner.
+
+    The length of the visibility graph path, the shortest one, is given for reference.
+    Run from the root of the repository with: python -m benchmarks.bench_smoothing
+"""
+import numpy as np
+
+from benchmarks.environments import random_environment, random_free_points
+from collision import ObstacleIndex
+from dijkstra import dijkstra
+from exact_cell_decomposition import exact_cell_decomposition
+from path_smoothing import postprocess
+from potential_field import potential_field
+from prm import PRM
+from visibility_graph import visibility_graph
+
+
+def planner_paths(p0, pf, obstacles, limits):
+    """ Path of each planner from p0 to pf, None when a graph planner finds none"""
+    paths = {}
+    for name, graph in (("PRM", PRM(p0, pf, obstacles, limits, n_samples=50 * len(obstacles), k=8, seed=0)),
+                        ("exact_cell_decomposition", exact_cell_decomposition(p0, pf, obstacles, limits)[0]),
+                        ("visibility_graph", visibility_graph(p0, pf, obstacles, limits))):
+        result = dijkstra(graph, p0, pf)
+        paths[name] = result[1][pf] + [pf] if result is not None else None
+    _, path = potential_field(p0, pf, obstacles, limits=limits)
+    # the descent often stops in a local minimum, its dense path is still worth simplifying
+    reached = np.linalg.norm(path[-1] - np.asarray(pf)) < 0.1
+    paths["potential_field" if reached else "potential_field (stuck)"] = path
+    return paths
+
+
+def main(n_obstacles=50, n_queries=5):
+    obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+    index = ObstacleIndex(obstacles)
+    points = random_free_points(2 * n_queries, obstacles, limits, seed=1)
+    print(f"{'planner':>24} {'options':>16} {'waypoints':>14} {'length':>16} {'shortest':>9} {'time [ms]':>10}")
+    for query in range(n_queries):
+        p0, pf = tuple(points[2 * query].tolist()), tuple(points[2 * query + 1].tolist())
+        paths = planner_paths(p0, pf, obstacles, limits)
+        shortest = postprocess(paths["visibility_graph"], index=index, shortcut=None)[1]["length_out"]
+        for name, path in paths.items():
+            if path is None:
+                continue
+            for options, kwargs in (("greedy", {}), ("random", {"shortcut": "random", "seed": 0}),
+                                    ("downsample", {"tolerance": 0.05, "shortcut": None}),
+                                    ("greedy + spline", {"spline": True})):
+                _, report = postprocess(path, index=index, **kwargs)
+                print(f"{name:>24} {options:>16} {report['waypoints_in']:>6} -> {report['waypoints_out']:>4} "
+                      f"{report['length_in']:>7.2f} -> {report['length_out']:>5.2f} {shortest:>9.2f} "
+                      f"{1e3 * report['time']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
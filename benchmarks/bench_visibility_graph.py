@@ -0,0 +1,31 @@
+""" Compares the naive batch visibility graph with the rotational sweep on growing random polygon maps.
+
+    Run from the root of the repository with: python -m benchmarks.bench_visibility_graph
+"""
+import time
+
+from benchmarks.environments import random_environment
+from collision import ObstacleIndex
+from visibility_graph import visibility_graph
+
+
+def main():
+    print(f"{'obstacles':>10} {'vertices':>9} {'edges':>8} {'naive [s]':>10} {'sweep [s]':>10} {'same':>5}")
+    for n_obstacles in (5, 20, 50, 100, 200):
+        obstacles, limits = random_environment(n_obstacles, seed=n_obstacles)
+        p0, pf = (0.0, 0.0), tuple(float(c) for c in limits[2])
+        index = ObstacleIndex(obstacles)
+
+        start = time.perf_counter()
+        naive = visibility_graph(p0, pf, obstacles, limits, index=index, method="naive")
+        t_naive = time.perf_counter() - start
+        start = time.perf_counter()
+        sweep = visibility_graph(p0, pf, obstacles, limits, index=index, method="sweep")
+        t_sweep = time.perf_counter() - start
+
+        n_edges = sum(len(neighbors) for neighbors in naive.values()) // 2
+        print(f"{n_obstacles:>10} {len(naive):>9} {n_edges:>8} {t_naive:>10.3f} {t_sweep:>10.3f} {str(naive == sweep):>5}")
+
+
+if __name__ == "__main__":
+    main()
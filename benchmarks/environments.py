@@ -0,0 +1,38 @@
+""" Reproducible random workspaces for the benchmarks"""
+import numpy as np
+
+from collision import ObstacleIndex
+
+
+def random_environment(n_obstacles, max_vertices=6, seed=0):
+    """ Creates a workspace with n_obstacles random convex polygons that do not overlap.
+        Each obstacle is placed in its own unit cell of a square grid, so the workspace grows with n_obstacles.
+
+    Returns:
+        obstacles: tuple of obstacles, each one a tuple of (x, y) vertices.
+        limits: the four corners of the workspace (botom-left, top-left, top-right, bottom-right).
+    """
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_obstacles)))
+    cells = rng.choice(side * side, size=n_obstacles, replace=False)
+    obstacles = []
+    for cell in cells:
+        center = np.array([cell % side, cell // side]) + 0.5 + rng.uniform(-0.05, 0.05, 2)
+        n_vertices = rng.integers(3, max_vertices + 1)
+        angles = np.sort(rng.uniform(0, 2 * np.pi, n_vertices))
+        radius = rng.uniform(0.2, 0.4)
+        vertices = center + radius * np.column_stack([np.cos(angles), np.sin(angles)])
+        obstacles.append(tuple(map(tuple, vertices.tolist())))
+    limits = ((0, 0), (0, side), (side, side), (side, 0))
+    return tuple(obstacles), limits
+
+
+def random_free_points(n_points, obstacles, limits, seed=0):
+    """ Samples n_points uniformly in the workspace outside of the obstacles, as an (n_points, 2) array"""
+    rng = np.random.default_rng(seed)
+    index = ObstacleIndex(obstacles)
+    points = np.zeros((0, 2))
+    while len(points) < n_points:
+        samples = rng.uniform(limits[0], limits[2], (2 * n_points, 2))
+        points = np.vstack([points, samples[~index.points_inside(samples)]])
+    return points[:n_points]
@@ -0,0 +1,140 @@
+""" Headless benchmark of all the planners on seeded random environments of increasing size.
+
+    For each environment and each random start and goal pair, the build phase (the planner that creates the
+    graph) and the query phase (`dijkstra` on that graph) are timed separately, then run again under
+    tracemalloc for their peak memory. The potential field has no separate build, the whole call is its query.
+    The results are written to a JSON or CSV file, to compare them across versions of the code.
+
+    Run from the root of the repository with, for example:
+        python -m benchmarks.suite --sizes 5 20 50 --queries 3 --output results.json
+"""
+import argparse
+import csv
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.environments import random_environment, random_free_points
+from dijkstra import dijkstra
+from exact_cell_decomposition import exact_cell_decomposition
+from path_smoothing import path_length
+from potential_field import potential_field
+from prm import PRM
+from visibility_graph import visibility_graph
+
+PLANNERS = ("visibility_graph", "PRM", "exact_cell_decomposition", "potential_field")
+
+FIELDS = ("planner", "n_obstacles", "n_vertices", "seed", "query", "build_time", "query_time", "build_peak_mb",
+          "query_peak_mb", "graph_nodes", "graph_edges", "success", "path_cost")
+
+
+def measure(function, memory=True):
+    """ Runs function and returns its result, its wall time in seconds and, if memory is True, the peak of
+        memory allocated by a second run in MB (tracemalloc slows the code down, so it is not timed)"""
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def build(planner, p0, pf, obstacles, limits, seed):
+    """ Build phase of a graph planner, returns its graph"""
+    if planner == "visibility_graph":
+        return visibility_graph(p0, pf, obstacles, limits)
+    if planner == "PRM":
+        return PRM(p0, pf, obstacles, limits, n_samples=50 * len(obstacles), k=8, seed=seed)
+    if planner == "exact_cell_decomposition":
+        return exact_cell_decomposition(p0, pf, obstacles, limits)[0]
+    raise ValueError(f"Unknown planner: {planner}")
+
+
+def run_query(planner, p0, pf, obstacles, limits, seed, memory=True):
+    """ Benchmarks one planner on one start and goal pair, returns the record without the environment fields"""
+    record = dict.fromkeys(FIELDS)
+    if planner == "potential_field":
+        (_, path), record["query_time"], record["query_peak_mb"] = measure(
+            lambda: potential_field(p0, pf, obstacles, limits=limits), memory)
+        # the gradient descent can stop in a local minimum before the goal
+        record["success"] = bool(np.linalg.norm(np.asarray(path[-1]) - pf) < 0.1)
+        record["path_cost"] = path_length(path) if record["success"] else None
+        return record
+
+    graph, record["build_time"], record["build_peak_mb"] = measure(
+        lambda: build(planner, p0, pf, obstacles, limits, seed), memory)
+    record["graph_nodes"] = len(graph)
+    record["graph_edges"] = sum(len(neighbors) for neighbors in graph.values()) // 2
+    result, record["query_time"], record["query_peak_mb"] = measure(lambda: dijkstra(graph, p0, pf), memory)
+    record["success"] = result is not None
+    record["path_cost"] = path_length(result[1][pf] + [pf]) if result is not None else None
+    return record
+
+
+def run(sizes=(5, 20, 50), n_queries=3, planners=PLANNERS, seed=0, memory=True):
+    """ Runs every planner on n_queries start and goal pairs of an environment of each size.
+        Returns the list of records, one per (size, planner, query)."""
+    records = []
+    for n_obstacles in sizes:
+        obstacles, limits = random_environment(n_obstacles, seed=seed + n_obstacles)
+        points = random_free_points(2 * n_queries, obstacles, limits, seed=seed + n_obstacles)
+        for query in range(n_queries):
+            p0, pf = tuple(points[2 * query].tolist()), tuple(points[2 * query + 1].tolist())
+            for planner in planners:
+                record = run_query(planner, p0, pf, obstacles, limits, seed + query, memory)
+                record.update(planner=planner, n_obstacles=n_obstacles, seed=seed,
+                              n_vertices=sum(len(obstacle) for obstacle in obstacles), query=query)
+                records.append(record)
+                print(f"{planner:>24} {n_obstacles:>5} obstacles, query {query}: "
+                      f"build {record['build_time'] or 0:.3f} s, query {record['query_time']:.3f} s, "
+                      f"cost {record['path_cost']}")
+    return records
+
+
+def metadata():
+    """ Version of the code and of the environment the benchmark ran on"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine()}
+
+
+def save(records, path):
+    """ Writes the records to a .csv file, or to a .json file with the metadata of the run"""
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(path, "w") as f:
+            json.dump({"metadata": metadata(), "results": records}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the planners on seeded random environments")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 20, 50], help="numbers of obstacles")
+    parser.add_argument("--queries", type=int, default=3, help="start and goal pairs per environment")
+    parser.add_argument("--planners", nargs="+", default=list(PLANNERS), choices=PLANNERS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc runs")
+    parser.add_argument("--output", default="benchmark_results.json", help=".json or .csv file")
+    args = parser.parse_args()
+
+    records = run(args.sizes, args.queries, args.planners, args.seed, memory=not args.no_memory)
+    save(records, args.output)
+    print(f"Saved {len(records)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+""" Vectorized collision checks between line segments and polygonal obstacles.
+
+    The obstacles are packed once into an (E, 2, 2) array with every edge of every polygon,
+    and query segments are checked in batches of shape (M, 2, 2).
+"""
+import numpy as np
+
+import instrumentation
+
+# maximum number of (segment, edge) pairs evaluated at once, bounds the temporary arrays
+CHUNK_PAIRS = 2 ** 20
+
+
+def pack_edges(obstacles):
+    """ Packs the edges of all the obstacles into an (E, 2, 2) array.
+        The edges of each obstacle are contiguous and keep the order of the vertices,
+        edge i of an obstacle goes from vertex i to vertex i + 1 (closing the polygon).
+    """
+    edges = [(obstacle[i], obstacle[(i + 1) % len(obstacle)])
+             for obstacle in obstacles for i in range(len(obstacle))]
+    return np.array(edges, dtype=float).reshape(-1, 2, 2)
+
+
+def ccw(A, B, C):
+    """ Elementwise counter-clockwise test of the points A, B, C, given as arrays of shape (..., 2)"""
+    return (C[..., 1] - A[..., 1]) * (B[..., 0] - A[..., 0]) > (B[..., 1] - A[..., 1]) * (C[..., 0] - A[..., 0])
+
+
+def pairwise_intersect(p1, p2, p3, p4):
+    """ Elementwise test of segment p1-p2 crossing segment p3-p4 (arrays broadcastable to (..., 2)).
+        Pairs where the segments share an endpoint are never reported as intersecting.
+    """
+    shared = (np.all(p1 == p3, axis=-1) | np.all(p1 == p4, axis=-1) |
+              np.all(p2 == p3, axis=-1) | np.all(p2 == p4, axis=-1))
+    crossing = (ccw(p1, p3, p4) != ccw(p2, p3, p4)) & (ccw(p1, p2, p3) != ccw(p1, p2, p4))
+    return crossing & ~shared
+
+
+def segments_intersect(segments, edges, return_edge=False):
+    """
+    Checks which of the query segments intersect any of the obstacle edges.
+
+    Parameters:
+        segments (array): (M, 2, 2) array with the two end points of each query segment.
+        edges (array): (E, 2, 2) array with the obstacle edges, see `pack_edges`.
+        return_edge (bool): also return the index of the first edge hit by each segment.
+
+    Returns:
+        array: (M,) boolean mask, True where the segment intersects an edge.
+        array: (M,) index of the first edge hit, -1 where there is none (only if return_edge).
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    hit = np.zeros(len(segments), dtype=bool)
+    first_edge = np.full(len(segments), -1, dtype=np.int64)
+    instrumentation.count("collision.segments", len(segments))
+    instrumentation.count("collision.edge_tests", len(segments) * len(edges))
+    if len(segments) == 0 or len(edges) == 0:
+        return (hit, first_edge) if return_edge else hit
+
+    p3 = edges[np.newaxis, :, 0]
+    p4 = edges[np.newaxis, :, 1]
+    chunk = max(1, CHUNK_PAIRS // len(edges))
+    for start in range(0, len(segments), chunk):
+        p1 = segments[start:start + chunk, np.newaxis, 0]
+        p2 = segments[start:start + chunk, np.newaxis, 1]
+        crossing = pairwise_intersect(p1, p2, p3, p4)
+        hit[start:start + chunk] = crossing.any(axis=1)
+        if return_edge:
+            first_edge[start:start + chunk] = np.where(hit[start:start + chunk], crossing.argmax(axis=1), -1)
+    return (hit, first_edge) if return_edge else hit
+
+
+def _expand_ranges(starts, counts):
+    """ Returns (owner, value) arrays listing start[i], start[i] + 1, ..., start[i] + counts[i] - 1 for every i"""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(owner.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(starts, counts) + offsets
+
+
+class ObstacleIndex:
+    """ Uniform grid over the obstacle edges, so that each query only checks the edges close to it.
+
+        Build it once per obstacle set and pass it to the planners to reuse it across queries.
+        Every edge is stored in the grid cells overlapped by its bounding box, and every obstacle
+        in the cells overlapped by the bounding box of the polygon (for the point queries).
+    """
+
+    def __init__(self, obstacles, cell_size=None):
+        self.obstacles = obstacles
+        self.edges = pack_edges(obstacles)
+        sizes = np.array([len(obstacle) for obstacle in obstacles], dtype=np.int64)
+        # the edges of obstacle i are edges[obstacle_start[i]:obstacle_start[i + 1]]
+        self.obstacle_start = np.concatenate([[0], np.cumsum(sizes)])
+        self.edge_obstacle = np.repeat(np.arange(len(sizes)), sizes)
+        if len(self.edges) == 0:
+            self.origin, self.cell_size, self.shape = np.zeros(2), 1.0, (1, 1)
+            self._edge_cells = (np.zeros(2, dtype=np.int64), np.zeros(0, dtype=np.int64))
+            self._obstacle_cells = (np.zeros(2, dtype=np.int64), np.zeros(0, dtype=np.int64))
+            return
+
+        # any point of the obstacle works to know which side of each edge is the inside of a convex polygon
+        self.centroids = np.add.reduceat(self.edges[:, 0], self.obstacle_start[:-1]) / sizes[:, np.newaxis]
+
+        lower = self.edges.min(axis=(0, 1))
+        upper = self.edges.max(axis=(0, 1))
+        if cell_size is None:
+            # about a constant number of edges per cell, but never cells smaller than the typical edge
+            lengths = np.linalg.norm(self.edges[:, 1] - self.edges[:, 0], axis=1)
+            area = max(np.prod(upper - lower), 1e-12)
+            cell_size = max(np.median(lengths), np.sqrt(area / len(self.edges)))
+        self.origin = lower
+        self.cell_size = float(cell_size)
+        self.shape = tuple(np.floor((upper - lower) / self.cell_size).astype(int) + 1)
+
+        edge_boxes = np.stack([self.edges.min(axis=1), self.edges.max(axis=1)], axis=1)
+        obstacle_boxes = np.stack([np.minimum.reduceat(self.edges[:, 0], self.obstacle_start[:-1]),
+                                   np.maximum.reduceat(self.edges[:, 0], self.obstacle_start[:-1])], axis=1)
+        self._edge_cells = self._bucket(edge_boxes)
+        self._obstacle_cells = self._bucket(obstacle_boxes)
+
+    def _cell_range(self, boxes):
+        """ Range of cells [(ix0, iy0), (ix1, iy1)] overlapped by each (lower, upper) box, clipped to the grid"""
+        low = np.floor((boxes[:, 0] - self.origin) / self.cell_size).astype(np.int64)
+        high = np.floor((boxes[:, 1] - self.origin) / self.cell_size).astype(np.int64)
+        limit = np.array(self.shape) - 1
+        empty = np.any(high < 0, axis=1) | np.any(low > limit, axis=1)
+        return np.clip(low, 0, limit), np.clip(high, 0, limit), empty
+
+    def _box_cells(self, boxes):
+        """ Returns (owner, cell) pairs with the flat index of every cell overlapped by each box"""
+        low, high, empty = self._cell_range(boxes)
+        nx = np.where(empty, 0, high[:, 0] - low[:, 0] + 1)
+        ny = np.where(empty, 0, high[:, 1] - low[:, 1] + 1)
+        owner, offset = _expand_ranges(np.zeros(len(boxes), dtype=np.int64), nx * ny)
+        ix = low[owner, 0] + offset // ny[owner]
+        iy = low[owner, 1] + offset % ny[owner]
+        return owner, ix * self.shape[1] + iy
+
+    def _bucket(self, boxes):
+        """ Compressed sparse row table from each grid cell to the boxes that overlap it"""
+        owner, cell = self._box_cells(boxes)
+        order = np.argsort(cell, kind="stable")
+        indptr = np.zeros(self.shape[0] * self.shape[1] + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(cell, minlength=self.shape[0] * self.shape[1]))
+        return indptr, owner[order]
+
+    def _candidates(self, owner, cell, table):
+        """ Expands (query, cell) pairs into the (query, item) pairs stored in those cells"""
+        indptr, items = table
+        query, position = _expand_ranges(indptr[cell], indptr[cell + 1] - indptr[cell])
+        return owner[query], items[position]
+
+    def segments_intersect(self, segments, return_edge=False, chunk=4096, ignore=None):
+        """ Same as `collision.segments_intersect`, only checking the edges in the cells crossed by each segment.
+            ignore: optional boolean mask over the obstacles, the edges of the masked ones are skipped, to
+                    drop obstacles without building the index again
+        """
+        segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+        hit = np.zeros(len(segments), dtype=bool)
+        first_edge = np.full(len(segments), -1, dtype=np.int64)
+        instrumentation.count("collision.segments", len(segments))
+        if len(self.edges) == 0:
+            return (hit, first_edge) if return_edge else hit
+
+        n_edges = len(self.edges)
+        for start in range(0, len(segments), chunk):
+            batch = segments[start:start + chunk]
+            owner, cell = self._segment_cells(batch)
+            owner, edge = self._candidates(owner, cell, self._edge_cells)
+            # an edge spanning several cells is found once per cell
+            key = np.unique(owner * n_edges + edge)
+            owner, edge = key // n_edges, key % n_edges
+            if ignore is not None:
+                kept = ~ignore[self.edge_obstacle[edge]]
+                owner, edge = owner[kept], edge[kept]
+            crossing = pairwise_intersect(batch[owner, 0], batch[owner, 1], self.edges[edge, 0], self.edges[edge, 1])
+            instrumentation.count("collision.edge_tests", len(owner))
+            owner, edge = owner[crossing], edge[crossing]
+            hit[start + owner] = True
+            if return_edge:
+                # the keys are sorted, so the first pair of each segment has its lowest edge index
+                queries, first = np.unique(owner, return_index=True)
+                first_edge[start + queries] = edge[first]
+        return (hit, first_edge) if return_edge else hit
+
+    def _segment_cells(self, segments):
+        """ Returns (owner, cell) pairs with the flat index of every grid cell crossed by each segment.
+            The segments are clipped to the grid, then walked from cell to cell (Amanatides-Woo): every time
+            a segment crosses a vertical or horizontal grid line it moves to the next cell in x or in y, so a
+            segment costs the number of cells it crosses instead of the cells of its bounding box."""
+        p, d = segments[:, 0], segments[:, 1] - segments[:, 0]
+        lower, upper = self.origin, self.origin + np.array(self.shape) * self.cell_size
+        # Liang-Barsky clipping to the grid rectangle
+        t0, t1 = np.zeros(len(segments)), np.ones(len(segments))
+        outside = np.zeros(len(segments), dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for axis in (0, 1):
+                moving = d[:, axis] != 0
+                ta = (lower[axis] - p[:, axis]) / d[:, axis]
+                tb = (upper[axis] - p[:, axis]) / d[:, axis]
+                t0 = np.where(moving, np.maximum(t0, np.minimum(ta, tb)), t0)
+                t1 = np.where(moving, np.minimum(t1, np.maximum(ta, tb)), t1)
+                outside |= ~moving & ((p[:, axis] < lower[axis]) | (p[:, axis] > upper[axis]))
+        inside = np.flatnonzero(~outside & (t0 <= t1))
+        p, d, t0, t1 = p[inside], d[inside], t0[inside], t1[inside]
+
+        limit = np.array(self.shape) - 1
+        first = np.clip(np.floor((p + t0[:, np.newaxis] * d - self.origin) / self.cell_size), 0, limit).astype(np.int64)
+        last = np.clip(np.floor((p + t1[:, np.newaxis] * d - self.origin) / self.cell_size), 0, limit).astype(np.int64)
+        step = np.sign(last - first)
+        n_steps = np.abs(last - first)
+
+        # parameter t of every grid line crossed, with the axis it steps along
+        crossings, axes, owners = [], [], []
+        for axis in (0, 1):
+            owner, offset = _expand_ranges(np.zeros(len(p), dtype=np.int64), n_steps[:, axis])
+            # the line between the cell reached after offset steps and the next one
+            line = first[owner, axis] + step[owner, axis] * offset + (step[owner, axis] > 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossings.append((self.origin[axis] + line * self.cell_size - p[owner, axis]) / d[owner, axis])
+            axes.append(np.full(len(owner), axis))
+            owners.append(owner)
+        crossing, axis, owner = np.concatenate(crossings), np.concatenate(axes), np.concatenate(owners)
+        order = np.lexsort((crossing, owner))
+        axis, owner = axis[order], owner[order]
+
+        # cell after each crossing: the first cell plus the steps taken so far along each axis
+        moves = np.zeros((len(owner), 2), dtype=np.int64)
+        moves[np.arange(len(owner)), axis] = step[owner, axis]
+        taken = np.cumsum(moves, axis=0)
+        # the crossings of each segment are contiguous, remove the steps of the previous segments
+        counts = n_steps.sum(axis=1)
+        before = np.concatenate([np.zeros((1, 2), dtype=np.int64), taken])[np.cumsum(counts) - counts]
+        cells = first[owner] + taken - before[owner]
+        owner = np.concatenate([np.arange(len(p)), owner])
+        cells = np.concatenate([first, cells])
+        return inside[owner], cells[:, 0] * self.shape[1] + cells[:, 1]
+
+    def points_inside(self, points):
+        """ Returns an (M,) boolean mask, True for the points inside (or on the boundary of) any convex obstacle"""
+        return self.locate(points) >= 0
+
+    def locate(self, points):
+        """ Returns an (M,) array with the index of the obstacle that contains each point, -1 for the free points"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        located = np.full(len(points), -1, dtype=np.int64)
+        if len(self.edges) == 0:
+            return located
+        owner, cell = self._box_cells(np.stack([points, points], axis=1))
+        owner, obstacle = self._candidates(owner, cell, self._obstacle_cells)
+        # expand every (point, obstacle) pair into the edges of the obstacle
+        counts = self.obstacle_start[obstacle + 1] - self.obstacle_start[obstacle]
+        pair, edge = _expand_ranges(self.obstacle_start[obstacle], counts)
+        a, b = self.edges[edge, 0], self.edges[edge, 1]
+        p, c = points[owner[pair]], self.centroids[obstacle[pair]]
+        side_p = (b[:, 0] - a[:, 0]) * (p[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (p[:, 0] - a[:, 0])
+        side_c = (b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])
+        outside = np.bincount(pair, weights=side_p * side_c < 0, minlength=len(obstacle)) > 0
+        located[owner[~outside]] = obstacle[~outside]
+        return located
@@ -1,51 +1,353 @@
 """ Implementation of Dijkstra's algorithm for finding the shortest path between nodes in a graph.
     Author: Andres Pulido"""
+import heapq
+import logging
+from collections.abc import Mapping
+from itertools import chain, count
 
+import numpy as np
 
-def dijkstra(graph, start, end):
+import instrumentation
+from graph import Graph, graph_to_csr
+
+
+def dijkstra(graph, start, end, heuristic=None):
     """Finds the shortest path between nodes in a graph using Dijkstra's algorithm.
 
     Args:
         graph: A dictionary representing the graph. The keys are the nodes and the values are dictionaries
-            containing the neighbors of the node and the distance to them.
+            containing the neighbors of the node and the distance to them. It can also be a `graph.Graph`,
+            with (x, y) points of the graph as start and end.
         start: The node to start the search from.
+        end: The node to stop the search at.
+        heuristic: Optional function h(node, end) that turns the search into A*. Use
+            `euclidean_heuristic` for the coordinate-tuple nodes built by the planners, it is the only
+            heuristic supported over a `graph.Graph`.
 
     Returns:
         A dictionary containing the shortest distance to each node from the start node and the path to each node.
+        The path to a node is the list of nodes visited before it, like in the original implementation, and is
+        rebuilt from a predecessor map only when it is asked for.
     """
-    # Initialize the distance and path dictionaries.
-    distance = {node: float('inf') for node in graph}
-    path = {node: [] for node in graph}
-    distance[start] = 0
+    if isinstance(graph, Graph):
+        return _dijkstra_graph(graph, start, end, heuristic)
+    distance = _DefaultDistance({start: 0})
+    predecessor = {start: None}
+    closed = set()
 
-    # Create a set of unvisited nodes.
-    unvisited = set(graph)
+    # The counter breaks ties so that the heap never has to compare two nodes.
+    tie = count()
+    h_start = heuristic(start, end) if heuristic is not None else 0
+    queue = [(h_start, next(tie), start)]
 
-    # Loop over the unvisited nodes, stop when visiting the end node
-    while unvisited:
-        # Get the node with the smallest distance.
-        current = min(unvisited, key=distance.get)
-
-        # Remove the current node from the unvisited set.
-        unvisited.remove(current)
+    while queue:
+        # Get the node with the smallest (estimated) distance.
+        _, _, current = heapq.heappop(queue)
+        if current in closed:
+            continue
+        closed.add(current)
 
         # If the current node is the end node, return the distance and path.
         if current == end:
-            print("Path found with Dijkstra's")
-            return distance, path
+            instrumentation.count("dijkstra.expanded", len(closed))
+            instrumentation.event("dijkstra.path_found", distance=distance[end], expanded=len(closed))
+            return distance, PathMap(predecessor)
 
         # Loop over the neighbors of the current node.
         for neighbor, weight in graph[current].items():
             # Calculate the distance to the neighbor node.
             new_distance = distance[current] + weight
 
-            # If the new distance is less than the current distance, update the distance and path.
+            # If the new distance is less than the current distance, update the distance and predecessor.
             if new_distance < distance[neighbor]:
                 distance[neighbor] = new_distance
-                path[neighbor] = path[current] + [current]
-    print("No path found in graph :(")
+                predecessor[neighbor] = current
+                priority = new_distance + heuristic(neighbor, end) if heuristic is not None else new_distance
+                heapq.heappush(queue, (priority, next(tie), neighbor))
+    instrumentation.count("dijkstra.expanded", len(closed))
+    instrumentation.event("dijkstra.no_path", level=logging.WARNING, start=start, end=end, expanded=len(closed))
+
+
+def _dijkstra_graph(graph, start, end, heuristic=None):
+    """`dijkstra` over a `graph.Graph`, the only heuristic supported is `euclidean_heuristic`"""
+    if heuristic is not None and heuristic is not euclidean_heuristic:
+        raise ValueError("A search over a graph.Graph only supports euclidean_heuristic as heuristic")
+    result = dijkstra_csr(graph.indptr, graph.indices, graph.weights, graph.node_index(start), graph.node_index(end),
+                          coords=graph.nodes if heuristic is not None else None)
+    if result is None:
+        return None
+    distance, predecessor = result
+    return _NodeDistance(graph, distance), _NodePathMap(graph, predecessor, graph.node_index(start))
+
+
+def euclidean_heuristic(node, end):
+    """Straight line distance between two coordinate tuples, admissible for the planners' graphs"""
+    return ((node[0] - end[0]) ** 2 + (node[1] - end[1]) ** 2) ** 0.5
+
+
+class _DefaultDistance(dict):
+    """Distance dictionary that reports infinity for the nodes the search never reached"""
+
+    def __missing__(self, node):
+        return float('inf')
+
+
+class PathMap(Mapping):
+    """Read-only mapping from a node to the list of nodes before it on the shortest path.
+
+    Only the predecessor of each node is stored during the search, the lists are rebuilt on access.
+    """
+
+    def __init__(self, predecessor):
+        self._predecessor = predecessor
+
+    def __getitem__(self, node):
+        if node not in self._predecessor:
+            return []
+        path = []
+        node = self._predecessor[node]
+        while node is not None:
+            path.append(node)
+            node = self._predecessor[node]
+        return path[::-1]
+
+    def __iter__(self):
+        return iter(self._predecessor)
+
+    def __len__(self):
+        return len(self._predecessor)
+
+
+class _NodeDistance(Mapping):
+    """Distance mapping of a search over a `graph.Graph`, from (x, y) nodes to the distances in an array"""
+
+    def __init__(self, graph, distance):
+        self._graph = graph
+        self._distance = distance
+
+    def __getitem__(self, node):
+        try:
+            return float(self._distance[self._graph.node_index(node)])
+        except KeyError:
+            return float('inf')
+
+    def __iter__(self):
+        return (tuple(node) for node in self._graph.nodes[np.isfinite(self._distance)].tolist())
+
+    def __len__(self):
+        return int(np.isfinite(self._distance).sum())
+
+
+class _NodePathMap(Mapping):
+    """`PathMap` of a search over a `graph.Graph`, from the predecessor array"""
+
+    def __init__(self, graph, predecessor, start):
+        self._graph = graph
+        self._predecessor = predecessor
+        self._start = start
+
+    def __getitem__(self, node):
+        try:
+            index = self._graph.node_index(node)
+        except KeyError:
+            return []
+        if self._predecessor[index] < 0:
+            return []
+        return [tuple(self._graph.nodes[ii].tolist()) for ii in path_from_predecessors(self._predecessor, index)[:-1]]
+
+    def __iter__(self):
+        reached = self._predecessor >= 0
+        reached[self._start] = True
+        return (tuple(node) for node in self._graph.nodes[reached].tolist())
+
+    def __len__(self):
+        return int(np.sum(self._predecessor >= 0)) + 1
 
 
+def dijkstra_csr(indptr, indices, weights, start, end, coords=None, overlay=None):
+    """Shortest path search over a graph in compressed sparse row form (see `graph_to_csr`).
+
+    Args:
+        indptr, indices, weights: CSR arrays of the graph, they can be memory-mapped.
+        start: index of the node to start the search from.
+        end: index of the node to stop the search at. With None the search visits every reachable node
+            and returns the whole shortest path tree from start.
+        coords: optional (N, 2) array with the position of each node. When given, the search
+            runs as A* with the Euclidean distance to the end node as heuristic.
+        overlay: optional dictionary {node: [(neighbor, weight), ...]} with extra edges searched on top
+            of the CSR arrays. Nodes past the last CSR index are extra nodes only reachable through the
+            overlay, like the start and end points of a roadmap query.
+
+    Returns:
+        distance: (N,) array with the shortest distance found to each node (inf if not reached).
+        predecessor: (N,) array with the previous node on the shortest path (-1 for none).
+        Returns None if the end node cannot be reached.
+    """
+    n_csr = len(indptr) - 1
+    overlay = overlay or {}
+    n_nodes = max([n_csr] + [node + 1 for node in overlay])
+    # plain python lists are much faster to index one element at a time than numpy arrays
+    dist = [float('inf')] * n_nodes
+    dist[start] = 0.0
+    predecessor = [-1] * n_nodes
+    closed = [False] * n_nodes
+
+    if coords is not None and end is not None:
+        coords = np.asarray(coords, dtype=float)
+        h = np.linalg.norm(coords - coords[end], axis=1).tolist()
+    else:
+        h = None
+
+    queue = [(h[start] if h else 0.0, start)]
+    expanded = 0
+    while queue:
+        _, current = heapq.heappop(queue)
+        if closed[current]:
+            continue
+        closed[current] = True
+        expanded += 1
+        if current == end:
+            instrumentation.count("dijkstra.expanded", expanded)
+            instrumentation.event("dijkstra.path_found", distance=dist[end], expanded=expanded)
+            return np.array(dist), np.array(predecessor, dtype=np.int64)
+
+        d_current = dist[current]
+        if current < n_csr:
+            # only the row of the current node is converted, so a search does not touch the whole graph
+            first, last = int(indptr[current]), int(indptr[current + 1])
+            edges = zip(indices[first:last].tolist(), weights[first:last].tolist())
+        else:
+            edges = ()
+        for neighbor, weight in chain(edges, overlay.get(current, ())):
+            new_distance = d_current + weight
+            if new_distance < dist[neighbor]:
+                dist[neighbor] = new_distance
+                predecessor[neighbor] = current
+                heapq.heappush(queue, (new_distance + h[neighbor] if h else new_distance, neighbor))
+    instrumentation.count("dijkstra.expanded", expanded)
+    if end is None:
+        return np.array(dist), np.array(predecessor, dtype=np.int64)
+    instrumentation.event("dijkstra.no_path", level=logging.WARNING, start=start, end=end, expanded=expanded)
+
+
+def path_from_predecessors(predecessor, end):
+    """Returns the list of node indices from the start node to end, following the predecessor array"""
+    path = [end]
+    while predecessor[path[-1]] >= 0:
+        path.append(int(predecessor[path[-1]]))
+    return path[::-1]
+
+
+class LPAStar:
+    """Lifelong Planning A*: shortest path between two fixed nodes that is repaired when edges change.
+
+    After the first search, `update_edge` only marks the end nodes of the changed edges as inconsistent,
+    and the next `compute_shortest_path` only expands the nodes whose distance really changed, instead of
+    searching the whole graph again (Koenig, Likhachev and Furcy, 2004).
+
+    Args:
+        graph: dictionary graph like in `dijkstra`, undirected. It is modified in place by `update_edge`.
+        start: the node to start the search from.
+        end: the node to find the path to.
+        heuristic: optional function h(node, end), must be consistent, like `euclidean_heuristic`.
+    """
+
+    def __init__(self, graph, start, end, heuristic=None):
+        self.graph = graph
+        self.start = start
+        self.end = end
+        self.heuristic = heuristic
+        self.g = _DefaultDistance()
+        # one step lookahead of g, the best g of a neighbor plus the edge weight
+        self.rhs = _DefaultDistance({start: 0})
+        self.expanded = 0
+        self._queue = []
+        self._key = {}
+        self._tie = count()
+        self._push(start)
+
+    def _calculate_key(self, node):
+        best = min(self.g[node], self.rhs[node])
+        return (best + (self.heuristic(node, self.end) if self.heuristic is not None else 0), best)
+
+    def _push(self, node):
+        key = self._calculate_key(node)
+        self._key[node] = key
+        heapq.heappush(self._queue, (key, next(self._tie), node))
+
+    def _top_key(self):
+        # the queue keeps old entries of the nodes that were updated or removed, they are skipped here
+        while self._queue and self._key.get(self._queue[0][2]) != self._queue[0][0]:
+            heapq.heappop(self._queue)
+        return self._queue[0][0] if self._queue else (float('inf'), float('inf'))
+
+    def _update_node(self, node):
+        if node != self.start:
+            self.rhs[node] = min((self.g[neighbor] + weight for neighbor, weight in self.graph.get(node, {}).items()),
+                                 default=float('inf'))
+        if self.g[node] != self.rhs[node]:
+            self._push(node)
+        else:
+            self._key.pop(node, None)
+
+    def update_edge(self, u, v, weight=None):
+        """Sets the weight of the edge u - v, adding the nodes if they are new. None removes the edge."""
+        self.graph.setdefault(u, {})
+        self.graph.setdefault(v, {})
+        if weight is None:
+            self.graph[u].pop(v, None)
+            self.graph[v].pop(u, None)
+        else:
+            self.graph[u][v] = self.graph[v][u] = weight
+        self._update_node(u)
+        self._update_node(v)
+
+    def remove_node(self, node):
+        """Removes a node and all its edges from the graph"""
+        neighbors = list(self.graph.pop(node, {}))
+        for neighbor in neighbors:
+            self.graph[neighbor].pop(node, None)
+        self.g.pop(node, None)
+        self.rhs.pop(node, None)
+        self._key.pop(node, None)
+        for neighbor in neighbors:
+            self._update_node(neighbor)
+
+    def compute_shortest_path(self):
+        """Expands the inconsistent nodes until the distance to the end node is final.
+
+        Returns:
+            The distance from start to end, inf if there is no path.
+        """
+        expanded = self.expanded
+        while self._top_key() < self._calculate_key(self.end) or self.rhs[self.end] != self.g[self.end]:
+            if not self._queue:
+                break
+            _, _, node = heapq.heappop(self._queue)
+            del self._key[node]
+            self.expanded += 1
+            if self.g[node] > self.rhs[node]:
+                self.g[node] = self.rhs[node]
+                for neighbor in self.graph[node]:
+                    self._update_node(neighbor)
+            else:
+                self.g[node] = float('inf')
+                self._update_node(node)
+                for neighbor in self.graph[node]:
+                    self._update_node(neighbor)
+        instrumentation.count("lpa.expanded", self.expanded - expanded)
+        return self.g[self.end]
+
+    def path(self):
+        """List of nodes from start to end on the current shortest path, empty if there is none"""
+        if self.g[self.end] == float('inf'):
+            return []
+        path = [self.end]
+        while path[-1] != self.start:
+            node = path[-1]
+            path.append(min(self.graph[node], key=lambda neighbor: self.g[neighbor] + self.graph[node][neighbor]))
+        return path[::-1]
+
 
 def main():
     graph = {"A": {"B": 4, "C": 2}, "B": {"A": 4, "C": 1, "D": 5}, "C": {"A": 2, "B": 1, "D": 8, "E": 10},
@@ -60,6 +362,13 @@ def main():
     print(f"Shortest distance from {start} to F is: {distance['F']}")
     print(f"and the path to get to F is: {path['F'] + ['F']}")
 
+    # same search over the compact CSR arrays
+    nodes, indptr, indices, weights = graph_to_csr(graph)
+    distance, predecessor = dijkstra_csr(indptr, indices, weights, nodes.index(start), nodes.index("F"))
+    print(f"CSR search: {distance[nodes.index('F')]} via "
+          f"{[nodes[ii] for ii in path_from_predecessors(predecessor, nodes.index('F'))]}")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    main()
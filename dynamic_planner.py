@@ -0,0 +1,233 @@
+""" Planner for maps where a few obstacles are added, moved or removed at a time.
+
+    The roadmap keeps every candidate edge with its collision status. When obstacles change, only the
+    candidate edges whose bounding box overlaps the old or new bounding box of the changed obstacles are
+    checked again, and the shortest path is repaired with `dijkstra.LPAStar` instead of searched again.
+    The obstacle index is not built again for each change either: the removed obstacles are masked out of it
+    and the added ones are checked apart, until enough changes pile up to index them all again.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from collision import ObstacleIndex, pack_edges, segments_intersect
+from dijkstra import LPAStar, euclidean_heuristic
+
+# number of obstacles added or removed since the obstacle index was built before building it again
+REINDEX_CHANGES = 16
+
+
+class DynamicPlanner:
+    """ Shortest path from p0 to pf that is kept up to date while the obstacles change.
+
+        p0: start point
+        pf: end point
+        obstacles: list of obstacles, each obstacle is a list of vertices. They are identified by their
+                   position in this list, the ids of the added obstacles are returned by `add_obstacle`.
+        limits: boundary of the workspace
+        planner: "PRM" or "visibility_graph". The PRM samples the whole workspace once, the samples that end
+                 up inside an obstacle simply lose their edges. The visibility graph adds and removes the
+                 vertices of the obstacles with them. The trapezoidal decomposition of
+                 `exact_cell_decomposition` has no local repair and is not supported.
+        n_samples, k, seed: PRM samples, number of nearest neighbors of each sample and random seed
+    """
+
+    def __init__(self, p0, pf, obstacles, limits, planner="PRM", n_samples=500, k=8, seed=None):
+        if planner not in ("PRM", "visibility_graph"):
+            raise ValueError(f"Unknown planner for dynamic planning: {planner}")
+        self.p0, self.pf = tuple(p0), tuple(pf)
+        self.limits = limits
+        self.planner = planner
+        self.obstacles = dict(enumerate(obstacles))
+        self._next_id = len(obstacles)
+        self._reindex()
+
+        # nodes of the roadmap, with the obstacle each one belongs to (-1 for the free points, -2 for the
+        # removed vertices, whose slots are reused by the next added ones)
+        self.nodes = [self.p0, self.pf] + [tuple(limit) for limit in limits]
+        if planner == "PRM":
+            rng = np.random.default_rng(seed)
+            self.nodes += [tuple(sample) for sample in rng.uniform(limits[0], limits[2], (n_samples, 2)).tolist()]
+        self.node_obstacle = [-1] * len(self.nodes)
+        self._coords = np.array(self.nodes, dtype=float)
+        self._free_slots = []
+        # live nodes at each point, several nodes can be at the same place (p0 on an obstacle vertex...)
+        self._node_at = {}
+        for node, point in enumerate(self.nodes):
+            self._node_at.setdefault(point, []).append(node)
+        self._obstacle_nodes = {}
+        # candidate edges (i, j), whether they are collision free and whether they still exist
+        self._pairs = np.zeros((0, 2), dtype=np.int64)
+        self._free = np.zeros(0, dtype=bool)
+        self._alive = np.zeros(0, dtype=bool)
+
+        self.lpa = LPAStar({node: {} for node in self.nodes}, self.p0, self.pf, euclidean_heuristic)
+        if planner == "PRM":
+            coords = np.array(self.nodes, dtype=float)
+            _, neighbors = cKDTree(coords).query(coords, k=min(k + 1, len(coords)))
+            i = np.repeat(np.arange(len(coords)), neighbors.shape[1] - 1)
+            j = neighbors[:, 1:].ravel()
+            self._add_pairs(np.unique(np.column_stack([np.minimum(i, j), np.maximum(i, j)]), axis=0))
+        else:
+            self._add_pairs(np.array([(a, b) for a in range(len(self.nodes)) for b in range(a + 1, len(self.nodes))]))
+            for obstacle_id, obstacle in self.obstacles.items():
+                self._add_vertices(obstacle_id, obstacle)
+
+    def _reindex(self):
+        """ Builds the obstacle index of the current obstacles"""
+        ids = list(self.obstacles)
+        self.index = ObstacleIndex([self.obstacles[obstacle_id] for obstacle_id in ids])
+        self._indexed = {obstacle_id: position for position, obstacle_id in enumerate(ids)}
+        # indexed obstacles removed since, and obstacles added since with their edges
+        self._stale = np.zeros(len(ids), dtype=bool)
+        self._unindexed = {}
+        self._unindexed_edges = pack_edges([])
+
+    def _blocked(self, segments):
+        """ (M,) boolean mask of the (M, 2, 2) segments that cross the current obstacles"""
+        hit = self.index.segments_intersect(segments, ignore=self._stale)
+        return hit | segments_intersect(segments, self._unindexed_edges)
+
+    def _add_pairs(self, pairs):
+        """ Adds candidate edges, checks them against the current obstacles and adds the free ones to the graph"""
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        free = ~self._blocked(self._coords[pairs])
+        self._pairs = np.vstack([self._pairs, pairs])
+        self._free = np.concatenate([self._free, free])
+        self._alive = np.concatenate([self._alive, np.ones(len(pairs), dtype=bool)])
+        for a, b in pairs[free].tolist():
+            self.lpa.update_edge(self.nodes[a], self.nodes[b], euclidean_heuristic(self.nodes[a], self.nodes[b]))
+
+    def _add_vertices(self, obstacle_id, obstacle):
+        """ Visibility graph: adds the vertices of an obstacle and their candidate edges to every other node"""
+        added = []
+        for vertex in obstacle:
+            point = tuple(vertex)
+            if self._free_slots:
+                node = self._free_slots.pop()
+                self.nodes[node], self.node_obstacle[node] = point, obstacle_id
+            else:
+                node = len(self.nodes)
+                self.nodes.append(point)
+                self.node_obstacle.append(obstacle_id)
+            self._node_at.setdefault(point, []).append(node)
+            added.append(node)
+        if len(self.nodes) > len(self._coords):
+            self._coords = np.vstack([self._coords, np.zeros((len(self.nodes) - len(self._coords), 2))])
+        self._coords[added] = np.asarray(obstacle, dtype=float)
+        self._obstacle_nodes[obstacle_id] = added
+        node_obstacle = np.array(self.node_obstacle)
+        # same as `visibility_graph`, two vertices of the same obstacle are never connected
+        others = np.flatnonzero((node_obstacle != -2) & (node_obstacle != obstacle_id))
+        self._add_pairs(np.column_stack([np.tile(others, len(added)), np.repeat(added, len(others))]))
+
+    def _remove_vertices(self, obstacle_id):
+        """ Visibility graph: removes the vertices of an obstacle and their edges"""
+        removed = self._obstacle_nodes.pop(obstacle_id)
+        dead = self._alive & np.isin(self._pairs, removed).any(axis=1)
+        self._alive &= ~dead
+        shared = []
+        for node in removed:
+            point = self.nodes[node]
+            others = self._node_at[point]
+            others.remove(node)
+            if others:
+                # p0, pf, a limit or the vertex of another obstacle is at the same place, keep the node
+                shared += others
+            else:
+                del self._node_at[point]
+                self.lpa.remove_node(point)
+            self.node_obstacle[node] = -2
+            self._free_slots.append(node)
+        if shared:
+            self._drop_shared_edges(np.flatnonzero(dead & self._free), shared)
+        if 2 * np.count_nonzero(self._alive) < len(self._alive):
+            # forget the edges of the removed vertices
+            self._pairs, self._free = self._pairs[self._alive], self._free[self._alive]
+            self._alive = np.ones(len(self._pairs), dtype=bool)
+
+    def _drop_shared_edges(self, dead, shared):
+        """ Removes from the graph the dead free edges between points that still have nodes, unless another
+            free edge joins the same points. shared: the nodes left at the points of the removed vertices"""
+        kept = set()
+        for a, b in self._pairs[self._alive & self._free & np.isin(self._pairs, shared).any(axis=1)].tolist():
+            kept.add(frozenset((self.nodes[a], self.nodes[b])))
+        for a, b in self._pairs[dead].tolist():
+            a, b = self.nodes[a], self.nodes[b]
+            if a in self._node_at and b in self._node_at and frozenset((a, b)) not in kept:
+                self.lpa.update_edge(a, b, None)
+
+    def _near(self, obstacles):
+        """ Candidate edges that still exist and whose bounding box overlaps the one of any of the obstacles"""
+        segments = self._coords[self._pairs]
+        lower, upper = segments.min(axis=1), segments.max(axis=1)
+        near = np.zeros(len(self._pairs), dtype=bool)
+        for obstacle in obstacles:
+            near |= np.all(lower <= np.max(obstacle, axis=0), axis=1) & np.all(upper >= np.min(obstacle, axis=0), axis=1)
+        return np.flatnonzero(near & self._alive)
+
+    def _recheck(self, removed, added):
+        """ Updates the status of the candidate edges around the removed and added obstacles.
+            A free edge can only be blocked by an added obstacle, and a blocked edge can only become free if
+            it crossed a removed one, so most edges are only checked against the few changed obstacles."""
+        coords = self._coords
+        blocked, freed = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if added:
+            near = self._near(added)
+            near = near[self._free[near]]
+            blocked = near[segments_intersect(coords[self._pairs[near]], pack_edges(added))]
+        if removed:
+            near = self._near(removed)
+            near = near[~self._free[near]]
+            near = near[segments_intersect(coords[self._pairs[near]], pack_edges(removed))]
+            freed = near[~self._blocked(coords[self._pairs[near]])]
+        self._free[blocked] = False
+        self._free[freed] = True
+        for edge in np.concatenate([blocked, freed]).tolist():
+            a, b = (self.nodes[node] for node in self._pairs[edge])
+            self.lpa.update_edge(a, b, euclidean_heuristic(a, b) if self._free[edge] else None)
+
+    def _update(self, removed, added):
+        """ Applies the removed and added {id: obstacle} and repairs the edges around them"""
+        for obstacle_id in removed:
+            del self.obstacles[obstacle_id]
+            if obstacle_id in self._indexed:
+                self._stale[self._indexed[obstacle_id]] = True
+            self._unindexed.pop(obstacle_id, None)
+        self.obstacles.update(added)
+        self._unindexed.update(added)
+        if np.count_nonzero(self._stale) + len(self._unindexed) > REINDEX_CHANGES:
+            self._reindex()
+        else:
+            self._unindexed_edges = pack_edges(list(self._unindexed.values()))
+        if self.planner == "visibility_graph":
+            for obstacle_id in removed:
+                self._remove_vertices(obstacle_id)
+        self._recheck(list(removed.values()), list(added.values()))
+        if self.planner == "visibility_graph":
+            for obstacle_id, obstacle in added.items():
+                self._add_vertices(obstacle_id, obstacle)
+
+    def add_obstacle(self, obstacle):
+        """ Adds an obstacle and returns its id"""
+        obstacle_id = self._next_id
+        self._next_id += 1
+        self._update({}, {obstacle_id: obstacle})
+        return obstacle_id
+
+    def remove_obstacle(self, obstacle_id):
+        """ Removes the obstacle with the given id"""
+        self._update({obstacle_id: self.obstacles[obstacle_id]}, {})
+
+    def move_obstacle(self, obstacle_id, obstacle):
+        """ Replaces the obstacle with the given id by a new polygon, for example the same one translated"""
+        self._update({obstacle_id: self.obstacles[obstacle_id]}, {obstacle_id: obstacle})
+
+    def plan(self):
+        """ Repairs the shortest path after the changes since the last call.
+
+        Returns:
+            distance: length of the path, inf if there is no path.
+            path: list of nodes from p0 to pf, empty if there is no path.
+        """
+        distance = self.lpa.compute_shortest_path()
+        return distance, self.lpa.path()
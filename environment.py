@@ -1,4 +1,6 @@
 """Defines the workspace to do a path planning comparison."""
+import logging
+
 import numpy as np
 import matplotlib.pyplot as plt
 from plot_environment import plot_environment, plot_path, plot_graph, plot_field, plot_decomposition
@@ -10,8 +12,10 @@ from potential_field import potential_field
 from prm import PRM
 
 
-def main(): 
-    algorithm = "exact_cell_decomposition"
+def main(algorithm="exact_cell_decomposition", show=True):
+    """ Plans a path in the example workspace with one of the algorithms below.
+        show: plot the result, False to only print it (for example in the benchmarks or without a display)
+    """
 
     p0 = (1, 1)
     pf = (9, 4)
@@ -28,20 +32,24 @@ def main():
 
     if algorithm == "potential_field":
         force_field, path = potential_field(p0, pf, obstacles)
-    elif algorithm == "exact_cell_decomposition":
-        graph, decomposition = exact_cell_decomposition(p0, pf, obstacles, limits)
-        distance, path = dijkstra(graph, p0, pf)
-        print(f"Shortest distance from {p0} to {pf} is: {distance[pf]}")
-        print(f"and the path to get to pf is: {path[pf] + [pf]}")
-    elif algorithm == "PRM":
-        graph = PRM(p0, pf, obstacles, limits)
-        distance, path = dijkstra(graph, p0, pf)
-    elif algorithm == "visibility_graph":
-        graph = visibility_graph(p0, pf, obstacles, limits)
-        distance, path = dijkstra(graph, p0, pf)
+    else:
+        if algorithm == "exact_cell_decomposition":
+            graph, decomposition = exact_cell_decomposition(p0, pf, obstacles, limits)
+        elif algorithm == "PRM":
+            graph = PRM(p0, pf, obstacles, limits)
+        elif algorithm == "visibility_graph":
+            graph = visibility_graph(p0, pf, obstacles, limits)
+        result = dijkstra(graph, p0, pf)
+        if result is None:
+            print(f"No path from {p0} to {pf} with {algorithm}")
+            return
+        distance, path = result
         print(f"Shortest distance from {p0} to {pf} is: {distance[pf]}")
         print(f"and the path to get to pf is: {path[pf] + [pf]}")
 
+    if not show:
+        return
+
     fig, ax = plt.subplots()
     if algorithm == "PRM" or algorithm == "visibility_graph":
         ax = plot_graph(ax, graph)
@@ -56,4 +64,5 @@ def main():
     plt.show()
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     main()
@@ -1,81 +1,203 @@
 """ this module contains the exact_cell_decomposition function
 """
+from bisect import bisect_left, bisect_right
+
 import numpy as np
 
-def exact_cell_decomposition(p0, pf, obstacles, limits):
-    # implement polygonal cell decomposition
-    vertex_arr = np.array([vertex for obstacle in obstacles for vertex in obstacle])
-    # sort the obstacles by the y-coordinate
-    vertex_arr = vertex_arr[vertex_arr[:, 1].argsort()]
-    # add top left and top right corners of the workspace
-    vertex_arr = np.vstack([vertex_arr, limits[1], limits[2]]).tolist()
-
-    polygons = [[list(limits[0]), list(limits[3])]]
-    pol_count = 0
-    for ii, vertex in enumerate(vertex_arr):
-        if vertex in polygons[-1]:
-            continue
-        else:
-            polygons.append([])
-
-            polygons[-1].append(vertex)
-
-            count = 0
-            while ii + count  + 1 < len(vertex_arr) and vertex[1] == vertex_arr[ii + count + 1][1]:
-                # assuming there are no obstacles blocking this line
-                polygons[-1].append(vertex_arr[ii + 1])
-                count += 1
-        
-            # check left
-            result, segment = is_line_intersecting_obstacle(tuple(vertex), (limits[0][0], vertex[1]), obstacles)
-            while segment is not None and segment[1][1] == vertex[1]:
-                result, segment = is_line_intersecting_obstacle(segment[1], (limits[3][0], vertex[1]), obstacles)
-            if result:
-                # add the intersection point to the polygon
-                polygons[-1].append([find_x_intercept(segment[0], segment[1], vertex[1]), vertex[1]])
-                # lower left corner of the previous polygon that intersects the obstacle
-                polygons[-1].append([find_x_intercept(segment[0], segment[1], polygons[-2][0][1]), polygons[-2][0][1]])  
-            else:
-                polygons[-1].append([limits[0][0], vertex[1]])
-                polygons[-1].append([limits[0][0], polygons[-2][0][1]])  # lower left corner of the previous polygon
-
-            # check right
-            result, segment = is_line_intersecting_obstacle(tuple(vertex), (limits[3][0], vertex[1]), obstacles)
-            while segment is not None and segment[1][1] == vertex[1]:
-                result, segment = is_line_intersecting_obstacle(segment[1], (limits[3][0], vertex[1]), obstacles)
-            if result:
-                # add the intersection point to the polygon
-                polygons[-1].append([find_x_intercept(segment[0], segment[1], vertex[1]), vertex[1]])
-                # lower left corner of the previous polygon that intersects the obstacle
-                polygons[-1].append([find_x_intercept(segment[0], segment[1], polygons[-2][0][1]), polygons[-2][0][1]])  
-                # TODO: keep track of the extra polygon added because of the intersection (use pol_count)
-            else:
-                polygons[-1].append([limits[3][0], vertex[1]])
-                polygons[-1].append([limits[3][0], polygons[-2][0][1]])  # lower right corner of the previous polygon
-    
-    polygons.pop(0)  # remove the first empty polygon
+import instrumentation
+from graph import Graph
+
+def exact_cell_decomposition(p0, pf, obstacles, limits, as_graph=False):
+    """ Trapezoidal decomposition of the free space with a sweep line moving up through the obstacle vertices.
+
+        The horizontal line through each vertex is extended to the closest obstacle (or the boundary) on each
+        side, which splits the free space into trapezoids whose left and right sides are pieces of obstacle
+        edges or of the boundary. Two cells are adjacent when they share a piece of one of those horizontal
+        lines, and the graph goes from the centroid of each cell through the midpoint of the shared piece
+        to the centroid of the other cell, so its size grows linearly with the number of vertices.
+        The obstacles are convex polygons that do not overlap, inside the limits.
+        as_graph: return the graph as a `graph.Graph` instead of a dictionary
+
+    Returns:
+        graph: graph with p0, pf, the cell centroids and the midpoints of the shared boundaries.
+        cells: list of trapezoids [[x, y] bottom left, bottom right, top right, top left].
+    """
+    with instrumentation.timer("exact_cell_decomposition.sweep"):
+        cells, links = trapezoidal_decomposition(obstacles, limits)
+    instrumentation.count("exact_cell_decomposition.cells", len(cells))
 
     graph = {}
     graph[p0] = {}
     graph[pf] = {}
 
-    # include centroids for each polygon to the graph
-    for polygon in polygons:
-        x = sum([vertex[0] for vertex in polygon]) / len(polygon)
-        y = sum([vertex[1] for vertex in polygon]) / len(polygon)
-        graph[(x, y)] = {}
-    
-    # Add edges to the graph
-    visited = set() 
-    for point in graph:
-        for other_point in graph:
-            if point != other_point and other_point not in visited:
-                if not is_line_intersecting_obstacle(point, other_point, obstacles)[0]:
-                    distance = np.linalg.norm(np.array(point) - np.array(other_point))
-                    graph[point][other_point] = graph[other_point][point] = distance 
-        visited.add(point)
-
-    return graph, polygons
+    # connect the centroids of the adjacent cells through the midpoint of their shared boundary
+    centroids = [tuple(np.mean(cell, axis=0).tolist()) for cell in cells]
+    crossings = [[] for _ in cells]
+    for a, b, low, high, y in links:
+        midpoint = ((low + high) / 2, y)
+        crossings[a].append(midpoint)
+        crossings[b].append(midpoint)
+    for centroid, cell_crossings in zip(centroids, crossings):
+        graph.setdefault(centroid, {})
+        for ii, midpoint in enumerate(cell_crossings):
+            _connect(graph, centroid, midpoint)
+            # the cells are convex, so the crossings of a cell also see each other. A cell has a few
+            # neighbors at most, and the shortcuts avoid going back and forth through wide cells
+            for other in cell_crossings[ii + 1:]:
+                # two crossings at the same height are on the bottom or top of the cell, along an obstacle
+                if other[1] != midpoint[1]:
+                    _connect(graph, midpoint, other)
+
+    # p0 and pf can reach every point of their own (convex) cell
+    located = locate_cell(cells, [p0, pf])
+    for point, cell in zip((p0, pf), located.tolist()):
+        if cell >= 0:
+            for node in [centroids[cell]] + crossings[cell]:
+                _connect(graph, point, node)
+    if located[0] >= 0 and located[0] == located[1]:
+        _connect(graph, p0, pf)
+
+    instrumentation.count("graph.nodes", len(graph))
+    instrumentation.count("graph.edges", sum(len(neighbors) for neighbors in graph.values()) // 2)
+    if as_graph:
+        return Graph.from_dict(graph), cells
+    return graph, cells
+
+
+def _connect(graph, a, b):
+    """ Adds the undirected edge a - b to the graph, with the euclidean distance as weight"""
+    distance = ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2) ** 0.5
+    graph.setdefault(a, {})[b] = distance
+    graph.setdefault(b, {})[a] = distance
+
+
+def _chain_x(obstacle, y):
+    """ Left and right x where the horizontal line at y crosses a convex obstacle"""
+    xs = []
+    for ii in range(len(obstacle)):
+        (x1, y1), (x2, y2) = obstacle[ii], obstacle[(ii + 1) % len(obstacle)]
+        if min(y1, y2) <= y <= max(y1, y2):
+            xs += [x1, x2] if y1 == y2 else [find_x_intercept((x1, y1), (x2, y2), y)]
+    return min(xs), max(xs)
+
+
+def trapezoidal_decomposition(obstacles, limits):
+    """ Sweeps a horizontal line from the bottom to the top of the workspace, see `exact_cell_decomposition`.
+
+        The line stops at each height with obstacle vertices, in order of (y, x). The obstacles crossed by
+        the line are kept sorted by x, with one open cell in each gap between them, so each stop only closes
+        and opens the cells next to its obstacle: a new obstacle splits the cell of its gap in two, the end
+        of an obstacle merges the cells on its sides, and a vertex on one side of an obstacle restarts the
+        cell on that side. Finding the gap of an obstacle is a binary search, O(n log n) in total.
+        A cell closed at the height it was opened (several stops at the same height) is dropped and the
+        cells opened after it inherit its neighbors below.
+
+    Returns:
+        cells: list of trapezoids [[x, y] bottom left, bottom right, top right, top left].
+        links: list of (cell a, cell b, x low, x high, y), cell a is below cell b and they share the
+               horizontal segment from (x low, y) to (x high, y).
+    """
+    x_min = min(limit[0] for limit in limits)
+    x_max = max(limit[0] for limit in limits)
+    y_min = min(limit[1] for limit in limits)
+    y_max = max(limit[1] for limit in limits)
+    tolerance = 1e-12 * max(x_max - x_min, y_max - y_min)
+
+    def wall_x(wall, y):
+        # walls are the boundary ("min" / "max") or the left (0) or right (1) side of an obstacle
+        if wall == "min":
+            return x_min
+        if wall == "max":
+            return x_max
+        return _chain_x(obstacles[wall[0]], y)[wall[1]]
+
+    cells, links = [], []
+
+    def open_cell(left, right, y, below):
+        x0, x1 = wall_x(left, y), wall_x(right, y)
+        # the cells closed at this height that share a piece of the line with the new cell
+        parents = [(cell, max(low, x0), min(high, x1)) for cell, low, high in below
+                   if min(high, x1) - max(low, x0) > tolerance]
+        return {"left": left, "right": right, "y": y, "x": (x0, x1), "parents": parents}
+
+    def close_cell(cell, y):
+        if y - cell["y"] <= tolerance:
+            # no height, the next cells connect directly to the ones below it
+            return cell["parents"]
+        x0, x1 = wall_x(cell["left"], y), wall_x(cell["right"], y)
+        if max(x1 - x0, cell["x"][1] - cell["x"][0]) <= tolerance:
+            # no width, a gap between an obstacle and the boundary or another obstacle that touches it
+            return []
+        index = len(cells)
+        cells.append([[cell["x"][0], cell["y"]], [cell["x"][1], cell["y"]], [x1, y], [x0, y]])
+        links.extend((parent, index, low, high, cell["y"]) for parent, low, high in cell["parents"])
+        return [(index, x0, x1)]
+
+    # one event per height of each obstacle, a flat obstacle starts and ends at the same height
+    events = []
+    for ii, obstacle in enumerate(obstacles):
+        ys = sorted(set(vertex[1] for vertex in obstacle))
+        for y in ys:
+            x = min(vertex[0] for vertex in obstacle if vertex[1] == y)
+            if y == ys[0]:
+                events.append((y, x, ii, 0, "start"))
+            if y == ys[-1]:
+                events.append((y, x, ii, 2, "end"))
+            elif y != ys[0]:
+                events.append((y, x, ii, 1, "bend"))
+    events.sort()
+
+    active = []  # obstacles crossed by the sweep line, sorted by x
+    open_cells = [open_cell("min", "max", y_min, [])]  # open_cells[g] is the gap left of active[g]
+    for y, x, obstacle, _, kind in events:
+        left_x, right_x = _chain_x(obstacles[obstacle], y)
+        if kind == "start":
+            gap = bisect_right(active, left_x, key=lambda other: _chain_x(obstacles[other], y)[1])
+            cell = open_cells[gap]
+            below = close_cell(cell, y)
+            active.insert(gap, obstacle)
+            open_cells[gap:gap + 1] = [open_cell(cell["left"], (obstacle, 0), y, below),
+                                       open_cell((obstacle, 1), cell["right"], y, below)]
+            continue
+
+        position = bisect_left(active, left_x, key=lambda other: _chain_x(obstacles[other], y)[0])
+        if position >= len(active) or active[position] != obstacle:
+            position = active.index(obstacle)
+        if kind == "end":
+            left, right = open_cells[position], open_cells[position + 1]
+            below = close_cell(left, y) + close_cell(right, y)
+            del active[position]
+            open_cells[position:position + 2] = [open_cell(left["left"], right["right"], y, below)]
+        else:
+            # the vertices at this height are on the left side, the right side or both sides of the obstacle
+            vertices_x = [vertex[0] for vertex in obstacles[obstacle] if vertex[1] == y]
+            middle = (left_x + right_x) / 2
+            for gap, on_side in ((position, min(vertices_x) <= middle), (position + 1, max(vertices_x) > middle)):
+                if on_side:
+                    cell = open_cells[gap]
+                    open_cells[gap] = open_cell(cell["left"], cell["right"], y, close_cell(cell, y))
+
+    for cell in open_cells:
+        close_cell(cell, y_max)
+    return cells, links
+
+
+def locate_cell(cells, points):
+    """ Returns the index of the cell that contains each point, -1 for the points outside all the cells"""
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    located = np.full(len(points), -1, dtype=np.int64)
+    if len(cells) == 0:
+        return located
+    cells = np.asarray(cells, dtype=float)
+    bottom, top = cells[:, 0, 1], cells[:, 2, 1]
+    for ii, (x, y) in enumerate(points):
+        t = (y - bottom) / (top - bottom)
+        left = cells[:, 0, 0] + t * (cells[:, 3, 0] - cells[:, 0, 0])
+        right = cells[:, 1, 0] + t * (cells[:, 2, 0] - cells[:, 1, 0])
+        inside = np.flatnonzero((bottom <= y) & (y <= top) & (left <= x) & (x <= right))
+        if len(inside):
+            located[ii] = inside[0]
+    return located
 
 def find_x_intercept(p1, p2, y3):
     x1, y1 = p1
@@ -89,32 +211,3 @@ def find_x_intercept(p1, p2, y3):
     # Calculate x-coordinate of intersection point
     x3 = (y3 - b) / m
     return x3
-
-def is_line_intersecting_obstacle(p1, p2, obstacles):
-    """
-    Checks if the line between two points intersects any of the obstacles,
-    defined by a list of the vertices in a convex polygon.
-    Returns True if the line intersects an obstacle, False otherwise.
-    
-    Parameters:
-        p1 (list): List representing the first point [x, y].
-        p2 (list): List representing the second point [x, y].
-        obstacles (list): List of obstacles, each obstacle is represented
-                          by a list of vertices [[x1, y1], [x2, y2], ...].
-    
-    Returns:
-        bool: True if the line intersects an obstacle, False otherwise.
-    """
-    def ccw(A, B, C):
-        return (C[1]-A[1]) * (B[0]-A[0]) > (B[1]-A[1]) * (C[0]-A[0])
-    
-    for obstacle in obstacles:
-        for i in range(len(obstacle)):
-            p3 = obstacle[i]
-            p4 = obstacle[(i + 1) % len(obstacle)]
-            if p1 == p3 or p1 == p4 or p2 == p3 or p2 == p4:
-                continue
-            else:
-                if ccw(p1, p3, p4) != ccw(p2, p3, p4) and ccw(p1, p2, p3) != ccw(p1, p2, p4):
-                    return (True, [p3, p4])
-    return (False, None)
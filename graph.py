@@ -0,0 +1,106 @@
+""" Compact graph with the node coordinates in an (N, 2) array and the edges in compressed sparse row arrays.
+
+    It holds the same information as the dictionary graphs of the planners ({(x, y): {(x, y): distance}}),
+    with about 20 bytes per edge instead of a few hundred, so large roadmaps fit in memory.
+"""
+import numpy as np
+
+
+def edges_to_csr(n_nodes, i, j, weights):
+    """ Builds the symmetric CSR arrays (indptr, indices, weights) of an undirected graph from its edge list"""
+    source = np.concatenate([i, j])
+    target = np.concatenate([j, i])
+    weights = np.concatenate([weights, weights])
+    order = np.argsort(source, kind="stable")
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(source, minlength=n_nodes))
+    return indptr, target[order].astype(np.int64), weights[order].astype(float)
+
+
+def graph_to_csr(graph):
+    """Converts a dict-of-dicts graph into integer-indexed compressed sparse row arrays.
+
+    Returns:
+        nodes: list with the node of each index.
+        indptr: (N + 1,) array, the neighbors of node i are indices[indptr[i]:indptr[i + 1]].
+        indices: (E,) array with the neighbor index of each edge.
+        weights: (E,) array with the weight of each edge.
+    """
+    nodes = list(graph)
+    index = {node: ii for ii, node in enumerate(nodes)}
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(graph[node]) for node in nodes])
+    indices = np.fromiter((index[neighbor] for node in nodes for neighbor in graph[node]),
+                          dtype=np.int64, count=indptr[-1])
+    weights = np.fromiter((weight for node in nodes for weight in graph[node].values()),
+                          dtype=float, count=indptr[-1])
+    return nodes, indptr, indices, weights
+
+
+class Graph:
+    """ Graph over points of the plane.
+
+        nodes: (N, 2) array with the coordinates of each node
+        indptr, indices, weights: the neighbors of node i are indices[indptr[i]:indptr[i + 1]], at a distance
+            weights[indptr[i]:indptr[i + 1]]. Undirected graphs list each edge in both directions.
+
+        `dijkstra.dijkstra` and `plot_environment.plot_graph` take it in place of a dictionary graph, and
+        `from_dict` / `to_dict` convert between both formats.
+    """
+
+    def __init__(self, nodes, indptr, indices, weights):
+        self.nodes = np.asarray(nodes, dtype=float).reshape(-1, 2)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=float)
+        # (x, y) -> node index, built on the first call to node_index
+        self._node_of = None
+
+    @classmethod
+    def from_edges(cls, nodes, i, j, weights):
+        """ Undirected graph from the arrays of the end nodes i, j and the weight of each edge"""
+        return cls(nodes, *edges_to_csr(len(nodes), np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64),
+                                        np.asarray(weights, dtype=float)))
+
+    @classmethod
+    def from_dict(cls, graph):
+        """ Converts a dictionary graph {(x, y): {(x, y): weight}}, the nodes keep their order"""
+        nodes, indptr, indices, weights = graph_to_csr(graph)
+        return cls(np.array(nodes, dtype=float).reshape(-1, 2), indptr, indices, weights)
+
+    def to_dict(self):
+        """ Dictionary graph with (x, y) tuples as nodes, like the planners build"""
+        nodes = [tuple(node) for node in self.nodes.tolist()]
+        indices, weights = self.indices.tolist(), self.weights.tolist()
+        indptr = self.indptr.tolist()
+        return {node: {nodes[indices[e]]: weights[e] for e in range(indptr[ii], indptr[ii + 1])}
+                for ii, node in enumerate(nodes)}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @property
+    def nbytes(self):
+        """ Memory used by the arrays of the graph"""
+        return self.nodes.nbytes + self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes
+
+    def node_index(self, point):
+        """ Index of the node at the given (x, y), raises KeyError if there is none"""
+        if self._node_of is None:
+            self._node_of = {}
+            for ii, node in enumerate(self.nodes.tolist()):
+                self._node_of.setdefault(tuple(node), ii)
+        try:
+            return self._node_of[float(point[0]), float(point[1])]
+        except KeyError:
+            raise KeyError(point) from None
+
+    def neighbors(self, node):
+        """ Arrays with the indices of the neighbors of a node index and the weight of the edges to them"""
+        return self.indices[self.indptr[node]:self.indptr[node + 1]], self.weights[self.indptr[node]:self.indptr[node + 1]]
+
+    def edges(self):
+        """ Arrays i, j, weights with each undirected edge once (i < j)"""
+        source = np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+        once = source < self.indices
+        return source[once], self.indices[once], self.weights[once]
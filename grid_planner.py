@@ -0,0 +1,207 @@
+""" Path planning on an occupancy grid, for maps that come as images or that are rasterized from the polygons.
+
+    The grid is a boolean array, True for the occupied cells, with row i at y = origin_y + (i + 0.5) * resolution.
+    The searches move to the 8 neighbors of a cell, diagonally only when both adjacent straight cells are free,
+    and keep their state (distances, parents) in flat lists indexed by cell, with the open list as a heap of
+    (priority, cell) pairs.
+"""
+import heapq
+
+import matplotlib.image as mpimg
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+import instrumentation
+from collision import ObstacleIndex
+
+SQRT2 = 2 ** 0.5
+
+
+class OccupancyGrid:
+    """ Occupancy grid of the workspace.
+
+        grid: (ny, nx) boolean array, True where the cell is occupied
+        origin: (x, y) of the lower left corner of the grid
+        resolution: side of a cell
+    """
+
+    def __init__(self, grid, origin=(0.0, 0.0), resolution=1.0):
+        self.grid = np.asarray(grid, dtype=bool)
+        self.origin = np.asarray(origin, dtype=float)
+        self.resolution = float(resolution)
+
+    @classmethod
+    def from_obstacles(cls, obstacles, limits, resolution, index=None):
+        """ Rasterizes the polygon obstacles, a cell is occupied when its center is inside an obstacle.
+            All the cell centers are tested at once with `collision.ObstacleIndex.points_inside`."""
+        index = index if index is not None else ObstacleIndex(obstacles)
+        lower = np.min(limits, axis=0).astype(float)
+        nx, ny = np.ceil((np.max(limits, axis=0) - lower) / resolution).astype(int)
+        x = lower[0] + (np.arange(nx) + 0.5) * resolution
+        y = lower[1] + (np.arange(ny) + 0.5) * resolution
+        centers = np.stack(np.meshgrid(x, y), axis=-1).reshape(-1, 2)
+        return cls(index.points_inside(centers).reshape(ny, nx), lower, resolution)
+
+    @classmethod
+    def from_image(cls, path, resolution=1.0, threshold=0.5, origin=(0.0, 0.0)):
+        """ Loads an image, the pixels darker than threshold (between 0 and 1) are occupied.
+            The first row of the image is the top of the map."""
+        image = mpimg.imread(path).astype(float)
+        if image.ndim == 3:
+            image = image[..., :3].mean(axis=2)
+        if image.max() > 1:
+            image /= 255
+        return cls(image[::-1] < threshold, origin, resolution)
+
+    def inflate(self, radius):
+        """ New grid with the obstacles grown by radius, so the planners can treat the robot as a point"""
+        distance = distance_transform_edt(~self.grid) * self.resolution
+        return OccupancyGrid(distance <= radius, self.origin, self.resolution)
+
+    def to_cell(self, point):
+        """ (row, column) of the cell that contains the point"""
+        column, row = np.floor((np.asarray(point, dtype=float) - self.origin) / self.resolution).astype(int)
+        return int(row), int(column)
+
+    def to_point(self, cell):
+        """ (x, y) of the center of a (row, column) cell"""
+        row, column = cell
+        return (float(self.origin[0] + (column + 0.5) * self.resolution),
+                float(self.origin[1] + (row + 0.5) * self.resolution))
+
+    def plan(self, p0, pf, method="jps"):
+        """ Shortest 8-connected path between the cells of p0 and pf.
+
+        method: "astar" expands every cell it reaches, "jps" (Jump Point Search) scans along straight and
+                diagonal lines and only stops at the cells where the path may turn, with the same result.
+
+        Returns:
+            distance: length of the path from p0 through the cell centers to pf, inf if there is no path.
+            path: list of (x, y) points from p0 to pf, empty if there is no path. With "jps" only the turns
+                  of the path are listed. p0 and pf in the same cell are joined directly.
+        """
+        ny, nx = self.grid.shape
+        start, end = self.to_cell(p0), self.to_cell(pf)
+        if not all(0 <= cell[0] < ny and 0 <= cell[1] < nx and not self.grid[cell] for cell in (start, end)):
+            return float("inf"), []
+        if start == end:
+            # the straight segment stays in the free cell
+            return float(np.linalg.norm(np.subtract(pf, p0))), [tuple(map(float, p0)), tuple(map(float, pf))]
+        # one cell of border around the grid, so the searches never check the bounds
+        free = np.pad(~self.grid, 1, constant_values=False).ravel().tolist()
+        width = nx + 2
+        start, end = (start[0] + 1) * width + start[1] + 1, (end[0] + 1) * width + end[1] + 1
+        if method == "astar":
+            cost, cells = _astar(free, width, start, end)
+        elif method == "jps":
+            cost, cells = _jps(free, width, start, end)
+        else:
+            raise ValueError(f"Unknown grid planning method: {method}")
+        if not cells:
+            return float("inf"), []
+        path = [tuple(map(float, p0))] + [self.to_point((cell // width - 1, cell % width - 1)) for cell in cells] + \
+            [tuple(map(float, pf))]
+        # the search only counts the moves between the cell centers, add the legs from p0 and to pf
+        legs = np.linalg.norm(np.subtract(path[1], path[0])) + np.linalg.norm(np.subtract(path[-1], path[-2]))
+        return float(cost * self.resolution + legs), path
+
+
+def _octile(a, b, width):
+    """ Length of the shortest 8-connected path between two cells without obstacles"""
+    dx, dy = abs(a % width - b % width), abs(a // width - b // width)
+    return max(dx, dy) + (SQRT2 - 1) * min(dx, dy)
+
+
+def _search(free, width, start, end, successors):
+    """ A* over the flat cell indices, successors(cell, parent) gives the (next cell, cost) pairs"""
+    n_cells = len(free)
+    g = [float("inf")] * n_cells
+    parent = [-1] * n_cells
+    closed = [False] * n_cells
+    g[start] = 0.0
+    queue = [(_octile(start, end, width), start)]
+    expanded = 0
+    while queue:
+        _, cell = heapq.heappop(queue)
+        if closed[cell]:
+            continue
+        closed[cell] = True
+        expanded += 1
+        if cell == end:
+            instrumentation.count("grid.expanded", expanded)
+            cells = [end]
+            while cells[-1] != start:
+                cells.append(parent[cells[-1]])
+            return g[end], cells[::-1]
+        g_cell = g[cell]
+        for neighbor, cost in successors(cell, parent[cell]):
+            if g_cell + cost < g[neighbor]:
+                g[neighbor] = g_cell + cost
+                parent[neighbor] = cell
+                heapq.heappush(queue, (g[neighbor] + _octile(neighbor, end, width), neighbor))
+    instrumentation.count("grid.expanded", expanded)
+    return float("inf"), []
+
+
+def _astar(free, width, start, end):
+    """ Plain A* over the 8 neighbors of each cell"""
+    straight = (1, -1, width, -width)
+
+    def successors(cell, _):
+        for step in straight:
+            if free[cell + step]:
+                yield cell + step, 1.0
+        for dx in (1, -1):
+            for dy in (width, -width):
+                if free[cell + dx] and free[cell + dy] and free[cell + dx + dy]:
+                    yield cell + dx + dy, SQRT2
+
+    return _search(free, width, start, end, successors)
+
+
+def _jps(free, width, start, end):
+    """ Jump Point Search, for 8-connected moves that never cut corners"""
+
+    def jump(cell, dx, dy):
+        # scans from cell in the direction (dx, dy), returns the first cell where the path may turn or -1
+        while True:
+            cell += dx + dy
+            if not free[cell]:
+                return -1
+            if cell == end:
+                return cell
+            if dx and dy:
+                if jump(cell, dx, 0) >= 0 or jump(cell, 0, dy) >= 0:
+                    return cell
+            elif dx:
+                # a wall that ends next to the row, the path can go around it
+                if (free[cell + width] and not free[cell - dx + width]) or \
+                        (free[cell - width] and not free[cell - dx - width]):
+                    return cell
+            elif (free[cell + 1] and not free[cell - dy + 1]) or (free[cell - 1] and not free[cell - dy - 1]):
+                return cell
+            if not (free[cell + dx] and free[cell + dy]):
+                return -1
+
+    def directions(cell, parent):
+        # the directions that can lead to a shorter path than going through the parent
+        if parent < 0:
+            return [(dx, dy) for dx in (-1, 0, 1) for dy in (-width, 0, width) if dx or dy]
+        dx = (cell % width > parent % width) - (cell % width < parent % width)
+        dy = ((cell // width > parent // width) - (cell // width < parent // width)) * width
+        if dx and dy:
+            return [(dx, 0), (0, dy), (dx, dy)]
+        if dx:
+            return [(dx, 0), (0, width), (0, -width), (dx, width), (dx, -width)]
+        return [(0, dy), (1, 0), (-1, 0), (1, dy), (-1, dy)]
+
+    def successors(cell, parent):
+        for dx, dy in directions(cell, parent):
+            if dx and dy and not (free[cell + dx] and free[cell + dy]):
+                continue
+            neighbor = jump(cell, dx, dy)
+            if neighbor >= 0:
+                yield neighbor, _octile(cell, neighbor, width)
+
+    cost, cells = _search(free, width, start, end, successors)
+    return cost, cells
@@ -0,0 +1,154 @@
+""" Opt-in counters, timers and profiling of the planners.
+
+    The planners report what they do with `count`, `timer` and `event`. While the instrumentation is
+    disabled (the default) `count` and `timer` only check a flag, and the loops of the searches add their
+    counts once at the end, so the cost is negligible. Enable it around a planning call to see where the time goes:
+
+        with instrumentation.instrumented() as stats:
+            graph = visibility_graph(p0, pf, obstacles, limits)
+            dijkstra(graph, p0, pf)
+        print(stats.counters, stats.timers)
+
+    The events (like a path found or not found) always go to the "path_planning" logger, with their fields in
+    the `fields` attribute of the log record, and are also kept in `stats.events` while enabled.
+"""
+import contextlib
+import cProfile
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+logger = logging.getLogger("path_planning")
+
+ENABLED = False
+
+
+class Stats:
+    """ Counters, total time of each timer (in seconds) and events recorded while the instrumentation is enabled"""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timers = defaultdict(float)
+        self.events = []
+
+    def as_dict(self):
+        return {"counters": dict(self.counters), "timers": dict(self.timers), "events": list(self.events)}
+
+
+stats = Stats()
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """ Starts new counters, timers and events, returns the new `Stats`"""
+    global stats
+    stats = Stats()
+    return stats
+
+
+def count(name, n=1):
+    """ Adds n to the counter name"""
+    if ENABLED:
+        stats.counters[name] += n
+
+
+class _Timer:
+    """ Adds the time spent inside the with block to the timer name"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stats.timers[self.name] += time.perf_counter() - self.start
+        return False
+
+
+_NO_TIMER = contextlib.nullcontext()
+
+
+def timer(name):
+    """ Context manager that times a phase of a planner, it does nothing while disabled"""
+    return _Timer(name) if ENABLED else _NO_TIMER
+
+
+def event(name, level=logging.INFO, **fields):
+    """ Logs an event with its fields, like event("dijkstra.path_found", distance=2.5)"""
+    if ENABLED:
+        stats.events.append({"event": name, **fields})
+    if logger.isEnabledFor(level):
+        details = " ".join(f"{key}={value}" for key, value in fields.items())
+        logger.log(level, f"{name} {details}".strip(), extra={"event": name, "fields": fields})
+
+
+@contextlib.contextmanager
+def instrumented():
+    """ Enables the instrumentation inside the with block and yields new `Stats` with what was recorded.
+        On exit the previous stats are restored, and when they were enabled (nested blocks) what was recorded
+        inside is added to them"""
+    global stats
+    previous, previous_stats = ENABLED, stats
+    new_stats = reset()
+    enable()
+    try:
+        yield new_stats
+    finally:
+        stats = previous_stats
+        if previous:
+            stats.counters.update(new_stats.counters)
+            for name, seconds in new_stats.timers.items():
+                stats.timers[name] += seconds
+            stats.events.extend(new_stats.events)
+        else:
+            disable()
+
+
+def profile(function, *args, cprofile=True, memory=False, top=20, **kwargs):
+    """ Runs function(*args, **kwargs) with the instrumentation enabled, and optionally under cProfile and tracemalloc.
+
+    Returns:
+        result: what the function returned.
+        report: dictionary with the counters, timers and events, the wall time, the cProfile statistics of the
+                top functions by cumulative time as text ("profile") and the peak traced memory in MB
+                with the top allocation sites ("peak_memory_mb", "memory").
+    """
+    profiler = cProfile.Profile() if cprofile else None
+    if memory:
+        tracemalloc.start()
+    with instrumented() as recorded:
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+    report = recorded.as_dict()
+    report["time"] = elapsed
+    if profiler is not None:
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(top)
+        report["profile"] = text.getvalue()
+    if memory:
+        snapshot = tracemalloc.take_snapshot()
+        report["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        report["memory"] = [str(stat) for stat in snapshot.statistics("lineno")[:top]]
+    return result, report
@@ -0,0 +1,94 @@
+""" Collision checks of large batches of segments on a pool of processes.
+
+    The obstacle vertices and the query segments are copied once into shared memory blocks. Every worker
+    attaches to them and builds its own `collision.ObstacleIndex` when it starts, so the tasks only carry
+    the (start, stop) range of segments they check and nothing is pickled per task.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from collision import ObstacleIndex
+
+# segments checked by one task
+CHUNK_SEGMENTS = 20000
+
+# state of each worker process, set by _init_worker
+_worker = {}
+
+
+def _share(array):
+    """ Copies an array into a new shared memory block, returns the block and its (name, shape, dtype)"""
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _attach(spec):
+    """ Opens a shared memory block created by _share, returns the block and the array view on it"""
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _init_worker(vertices_spec, start_spec, segments_spec):
+    """ Attaches the worker to the shared arrays and builds its obstacle index"""
+    blocks = []
+    for key, spec in (("vertices", vertices_spec), ("start", start_spec), ("segments", segments_spec)):
+        block, array = _attach(spec)
+        blocks.append(block)
+        _worker[key] = array
+    vertices, start = _worker["vertices"], _worker["start"]
+    obstacles = [[tuple(vertex) for vertex in vertices[start[ii]:start[ii + 1]].tolist()]
+                 for ii in range(len(start) - 1)]
+    _worker["index"] = ObstacleIndex(obstacles)
+    # the blocks must stay open for as long as the views are used
+    _worker["blocks"] = blocks
+
+
+def _check(start, stop):
+    """ Task run by the workers: collision mask of the shared segments[start:stop]"""
+    return start, _worker["index"].segments_intersect(_worker["segments"][start:stop])
+
+
+def segments_intersect_parallel(segments, obstacles, workers=None, chunk=CHUNK_SEGMENTS):
+    """ Same as `collision.ObstacleIndex.segments_intersect`, with the segments split in chunks over a process pool.
+
+    Parameters:
+        segments (array): (M, 2, 2) array with the two end points of each query segment.
+        obstacles (list): list of obstacles, each one a list of vertices.
+        workers (int): number of processes, the number of CPUs by default. With 1 worker, or a single
+                       chunk, the segments are checked in this process.
+        chunk (int): number of segments checked by each task.
+
+    Returns:
+        array: (M,) boolean mask, True where the segment intersects an obstacle. The result is the same
+               as the serial check whatever the number of workers and the order the tasks finish in.
+    """
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    if workers == 1 or len(segments) <= chunk:
+        return ObstacleIndex(obstacles).segments_intersect(segments)
+
+    vertices = np.array([vertex for obstacle in obstacles for vertex in obstacle], dtype=float).reshape(-1, 2)
+    start = np.concatenate([[0], np.cumsum([len(obstacle) for obstacle in obstacles])]).astype(np.int64)
+    blocks, specs = [], []
+    try:
+        for array in (vertices, start, segments):
+            block, spec = _share(array)
+            blocks.append(block)
+            specs.append(spec)
+        hit = np.zeros(len(segments), dtype=bool)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=tuple(specs)) as pool:
+            tasks = [pool.submit(_check, first, min(first + chunk, len(segments)))
+                     for first in range(0, len(segments), chunk)]
+            # every task writes its own range of the mask, so the merge does not depend on the finishing order
+            for task in tasks:
+                first, mask = task.result()
+                hit[first:first + len(mask)] = mask
+        return hit
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
@@ -0,0 +1,236 @@
+"""Particle filter to localize a robot on an elevation map, vectorized version of the functions in
+ParticleFilterLocalization.ipynb. Every step works on the whole (N, 3) array of particles (x, y, theta) at once."""
+import time
+
+import numpy as np
+from scipy.special import ndtri
+
+# Standard deviation of the sensor noise
+SIGMA_SENSOR = 5
+
+# Standard deviations of the noise added to the particles after resampling
+SIGMA_PARTICLE_STEP = 2
+SIGMA_PARTICLE_TURN = np.pi / 24
+
+
+def init(num_particles, width, height, rng=None):
+    """Spreads num_particles particles uniformly over the map with random headings"""
+    rng = np.random.default_rng() if rng is None else rng
+    particles = rng.random((num_particles, 3))
+    particles *= np.array((width, height, np.radians(360)))
+    return particles
+
+
+def move_particles(particles, fwd, turn):
+    """Moves every particle fwd pixels along its heading and then turns it, in place"""
+    particles[:, 0] += fwd * np.cos(particles[:, 2])
+    particles[:, 1] += fwd * np.sin(particles[:, 2])
+    particles[:, 2] += turn
+    return particles
+
+
+def sense(map, x, y, noisy=False, rng=None):
+    """Elevation of the map at the positions x, y (scalars or arrays) in a single lookup.
+    The positions out of the map get the value at the edge."""
+    height, width = map.shape
+    x = np.clip(np.asarray(x).astype(int), 0, width - 1)
+    y = np.clip(np.asarray(y).astype(int), 0, height - 1)
+    if noisy:
+        rng = np.random.default_rng() if rng is None else rng
+        return map[y, x] + rng.normal(0.0, SIGMA_SENSOR, np.shape(x))
+    return map[y, x]
+
+
+def compute_weights(particles, robot_sensor, map):
+    """Weight of each particle from the difference between its expected reading and the robot reading"""
+    height, width = map.shape
+    particle_sensor = sense(map, particles[:, 0], particles[:, 1]).astype(float)
+    errors = np.abs(robot_sensor - particle_sensor)
+    weights = np.max(errors) - errors
+
+    # Kill off particles on edge
+    weights[
+        (particles[:, 0] <= 0) |
+        (particles[:, 0] >= width - 1) |
+        (particles[:, 1] <= 0) |
+        (particles[:, 1] >= height - 1)
+    ] = 0.0
+
+    # Increase sensitivity
+    weights = weights ** 3
+    return weights
+
+
+def resample(particles, weights, method="systematic", num_particles=None, rng=None):
+    """Draws a new set of particles with probability proportional to the weights.
+
+    method: "systematic" (also known as low variance resampling) uses a single random offset and N evenly
+        spaced pointers, "stratified" one random pointer in each of the N strata. Both find the pointers in
+        the cumulative sum with a vectorized binary search, O(N log N), which is faster in numpy than a linear
+        merge pass in Python. "multinomial" draws N independent samples like the notebook version.
+    num_particles: size of the new set, the same as the current one by default
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(particles) if num_particles is None else num_particles
+    total = np.sum(weights)
+    if not total > 0:
+        # no information in the weights, keep a uniform draw of the current particles
+        return particles[rng.integers(0, len(particles), n)]
+    if method == "multinomial":
+        return particles[rng.choice(len(particles), size=n, p=weights / total)]
+
+    if method == "systematic":
+        pointers = (rng.random() + np.arange(n)) / n
+    elif method == "stratified":
+        pointers = (rng.random(n) + np.arange(n)) / n
+    else:
+        raise ValueError(f"Unknown resampling method: {method}")
+    cumulative = np.cumsum(weights)
+    cumulative /= cumulative[-1]
+    new_index = np.minimum(np.searchsorted(cumulative, pointers, side="right"), len(particles) - 1)
+    return particles[new_index]
+
+
+def add_noise(particles, rng=None):
+    """Perturbs the particles with Gaussian noise on the position and heading, in place"""
+    rng = np.random.default_rng() if rng is None else rng
+    particles += rng.normal(0.0, 1.0, particles.shape) * np.array(
+        (SIGMA_PARTICLE_STEP, SIGMA_PARTICLE_STEP, SIGMA_PARTICLE_TURN))
+    return particles
+
+
+def update(particles, fwd, turn, robot_sensor, map, method="systematic", rng=None):
+    """One step of the filter: move the particles with the command, weight them with the robot reading,
+    resample and perturb them"""
+    particles = move_particles(particles, fwd, turn)
+    weights = compute_weights(particles, robot_sensor, map)
+    particles = resample(particles, weights, method=method, rng=rng)
+    return add_noise(particles, rng=rng)
+
+
+def estimate(particles, weights=None):
+    """Mean position of the particles, weighted by the weights if they are given"""
+    return np.average(particles[:, 0], weights=weights), np.average(particles[:, 1], weights=weights)
+
+
+def effective_sample_size(weights):
+    """Number of equally weighted particles that would carry the same information, between 1 and N"""
+    total = np.sum(weights)
+    if not total > 0:
+        return 0.0
+    normalized = weights / total
+    return 1.0 / np.sum(normalized ** 2)
+
+
+def occupied_bins(particles, bin_size):
+    """Bin index of each particle in a histogram over (x, y, theta) with the given bin sizes.
+    Returns the bin of each particle, as an (N,) array of integers, and the number of occupied bins."""
+    cells = np.floor(particles / np.asarray(bin_size)).astype(np.int64)
+    cells[:, 2] %= int(np.ceil(2 * np.pi / bin_size[2]))
+    # one integer key per cell, so the bins are found with a 1D unique
+    cells -= cells.min(axis=0)
+    span = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * span[1] + cells[:, 1]) * span[2] + cells[:, 2]
+    _, bins = np.unique(keys, return_inverse=True)
+    return bins, (bins.max() + 1 if len(bins) else 0)
+
+
+def kld_sample_size(k, epsilon=0.05, delta=0.01):
+    """Number of particles needed so that, with probability 1 - delta, the KL divergence between the
+    particle belief and the true posterior is below epsilon, when the belief covers k histogram bins
+    (Fox, 2003). Works on scalars and arrays of k."""
+    k = np.asarray(k, dtype=float)
+    a = 2.0 / (9.0 * np.maximum(k - 1, 1))
+    n = (np.maximum(k - 1, 1) / (2 * epsilon)) * (1 - a + np.sqrt(a) * ndtri(1 - delta)) ** 3
+    return np.where(k > 1, np.ceil(n), 1).astype(np.int64)
+
+
+def kld_resample(particles, weights, bin_size, epsilon=0.05, delta=0.01, min_particles=100,
+                 max_particles=100000, rng=None):
+    """KLD-sampling: resamples as many particles as the spread of the belief needs.
+
+    The new set is the shortest sequence of draws that has at least min_particles and at least
+    kld_sample_size(k) particles, k being the number of histogram bins the draws occupy so far.
+    Instead of drawing one particle at a time, batches of doubling size are drawn (systematic resampling,
+    then shuffled) until one of them is long enough, so the work stays proportional to the result.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    size = min(min_particles, max_particles)
+    while True:
+        draws = resample(particles, weights, num_particles=size, rng=rng)
+        draws = draws[rng.permutation(len(draws))]
+        bins, _ = occupied_bins(draws, bin_size)
+        # number of occupied bins after each draw: a bin is new at the position of its first draw
+        new_bin = np.zeros(len(draws), dtype=np.int64)
+        new_bin[np.unique(bins, return_index=True)[1]] = 1
+        n = np.arange(1, len(draws) + 1)
+        enough = (n >= kld_sample_size(np.cumsum(new_bin), epsilon, delta)) & (n >= min_particles)
+        if np.any(enough):
+            return draws[:np.argmax(enough) + 1]
+        if size >= max_particles:
+            return draws
+        size = min(2 * size, max_particles)
+
+
+class ParticleFilter:
+    """Particle filter that adapts its number of particles and only resamples when the weights degenerate.
+
+    map: the elevation map, as a 2D array
+    num_particles: initial number of particles
+    resample_threshold: resample when the effective sample size drops below this fraction of the particles
+    adaptive: resize the particle set with KLD-sampling when resampling, see `kld_resample`
+    bin_size: histogram bin size in (x, y, theta) for KLD-sampling
+    epsilon, delta, min_particles, max_particles: bounds of KLD-sampling. max_particles is num_particles by
+        default, so KLD-sampling only ever shrinks the set below its initial size
+
+    After each `step`, `metrics` has one dictionary with the time spent, the number of particles, the
+    effective sample size and whether the step resampled.
+    """
+
+    def __init__(self, map, num_particles=3000, resample_threshold=0.5, adaptive=True, bin_size=(5, 5, np.pi / 8),
+                 epsilon=0.05, delta=0.01, min_particles=100, max_particles=None, rng=None):
+        self.map = map
+        self.rng = np.random.default_rng() if rng is None else rng
+        height, width = map.shape
+        self.particles = init(num_particles, width, height, self.rng)
+        self.weights = np.full(num_particles, 1.0 / num_particles)
+        self.resample_threshold = resample_threshold
+        self.adaptive = adaptive
+        self.bin_size = bin_size
+        self.epsilon = epsilon
+        self.delta = delta
+        self.min_particles = min_particles
+        self.max_particles = num_particles if max_particles is None else max_particles
+        self.metrics = []
+
+    def step(self, fwd, turn, robot_sensor):
+        """Moves the particles with the command and updates the belief with the robot reading"""
+        start = time.perf_counter()
+        self.particles = move_particles(self.particles, fwd, turn)
+        # the weights accumulate over the steps without resampling
+        self.weights = self.weights * compute_weights(self.particles, robot_sensor, self.map)
+        total = np.sum(self.weights)
+        self.weights = self.weights / total if total > 0 else np.full(len(self.particles), 1.0 / len(self.particles))
+        ess = effective_sample_size(self.weights)
+
+        resampled = ess < self.resample_threshold * len(self.particles)
+        if resampled:
+            if self.adaptive:
+                self.particles = kld_resample(self.particles, self.weights, self.bin_size, self.epsilon, self.delta,
+                                              self.min_particles, self.max_particles, self.rng)
+            else:
+                self.particles = resample(self.particles, self.weights, rng=self.rng)
+            self.weights = np.full(len(self.particles), 1.0 / len(self.particles))
+        self.particles = add_noise(self.particles, rng=self.rng)
+
+        self.metrics.append({
+            "time": time.perf_counter() - start,
+            "num_particles": len(self.particles),
+            "effective_sample_size": ess,
+            "resampled": bool(resampled),
+        })
+        return self.particles
+
+    def estimate(self):
+        """Weighted mean position of the particles"""
+        return estimate(self.particles, self.weights)
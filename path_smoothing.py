@@ -0,0 +1,227 @@
+""" Post-processing of the planned paths: shortcutting, downsampling and spline smoothing.
+
+    The paths of the PRM, of the cell decomposition and above all of the potential field (one point per step of
+    the gradient descent) have many more waypoints than needed. The functions below take a path as a list of
+    points (tuples or arrays) and a `collision.ObstacleIndex` of the obstacles, check all the candidate segments
+    of a step at once, and only ever replace a part of the path by segments that are collision free.
+"""
+import time
+
+import numpy as np
+from scipy.interpolate import splev, splprep
+
+import instrumentation
+from collision import ObstacleIndex
+
+
+def path_length(path):
+    """ Length of a path given as a list of points"""
+    points = np.asarray(path, dtype=float).reshape(-1, 2)
+    return float(np.sum(np.linalg.norm(np.diff(points, axis=0), axis=1)))
+
+
+def segments_free(segments, index):
+    """ (M,) boolean mask, True for the (M, 2, 2) segments that neither cross an obstacle edge nor cut through an
+        obstacle from one vertex to another (the crossing test ignores the edges touching the end points)"""
+    segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+    return ~index.segments_intersect(segments) & ~index.points_inside(segments.mean(axis=1))
+
+
+def _as_points(path):
+    """ (N, 2) array of the path without repeated consecutive points"""
+    points = np.asarray(path, dtype=float).reshape(-1, 2)
+    if len(points) > 1:
+        keep = np.concatenate([[True], np.any(points[1:] != points[:-1], axis=1)])
+        points = points[keep]
+    return points
+
+
+def shortcut_greedy(path, index):
+    """ From the start, jumps to the farthest waypoint that can be reached in a straight line, then repeats
+        from there. The segments from a waypoint to all the later ones are checked in one batch.
+
+        Returns the indices of the kept waypoints.
+    """
+    points = _as_points(path)
+    if len(points) < 2:
+        return list(range(len(points)))
+    kept = [0]
+    while kept[-1] < len(points) - 1:
+        anchor = kept[-1]
+        later = np.arange(anchor + 2, len(points))
+        segments = np.stack([np.broadcast_to(points[anchor], (len(later), 2)), points[later]], axis=1)
+        free = later[segments_free(segments, index)]
+        # the next waypoint is always reachable, it was on the path
+        kept.append(int(free[-1]) if len(free) else anchor + 1)
+    return kept
+
+
+def shortcut_random(path, index, iterations=20, batch=64, seed=None):
+    """ Randomized shortcutting: each iteration draws batch pairs of waypoints, checks the segments between them
+        at once and applies the free shortcuts that do not overlap, the ones that save the most length first.
+        It keeps more of the shape of the path than `shortcut_greedy`, and can find shorter paths when the
+        greedy jumps get stuck behind an obstacle.
+
+        Returns the path as an (N, 2) array.
+    """
+    rng = np.random.default_rng(seed)
+    points = _as_points(path)
+    for _ in range(iterations):
+        if len(points) < 3:
+            break
+        # short paths have fewer pairs than a batch, try them all
+        every_pair = len(points) * (len(points) - 1) // 2 <= batch
+        if every_pair:
+            i, j = np.triu_indices(len(points), k=2)
+        else:
+            i, j = np.unique(np.sort(rng.integers(0, len(points), (batch, 2)), axis=1), axis=0).T
+            candidate = j - i > 1
+            i, j = i[candidate], j[candidate]
+        free = segments_free(np.stack([points[i], points[j]], axis=1), index)
+        i, j = i[free], j[free]
+        if len(i) == 0:
+            if every_pair:
+                break
+            continue
+        # length of the path between the two waypoints minus the length of the shortcut
+        along = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))])
+        gain = along[j] - along[i] - np.linalg.norm(points[j] - points[i], axis=1)
+        order = np.argsort(-gain)
+        removed = np.zeros(len(points), dtype=bool)
+        taken = np.zeros(len(points), dtype=bool)
+        for a, b in zip(i[order].tolist(), j[order].tolist()):
+            if not taken[a:b + 1].any():
+                taken[a:b + 1] = True
+                removed[a + 1:b] = True
+        points = points[~removed]
+    return points
+
+
+def downsample(path, index, tolerance=0.05):
+    """ Ramer-Douglas-Peucker simplification: keeps the fewest waypoints such that the path moves at most
+        tolerance away from the original one, splitting further the simplified segments that would collide.
+
+        Returns the indices of the kept waypoints.
+    """
+    points = _as_points(path)
+    if len(points) < 2:
+        return list(range(len(points)))
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    spans = [(0, len(points) - 1)]
+    while spans:
+        # check the segments of all the current spans at once
+        starts, ends = np.array(spans).T
+        free = segments_free(np.stack([points[starts], points[ends]], axis=1), index)
+        spans = []
+        for start, end, is_free in zip(starts.tolist(), ends.tolist(), free.tolist()):
+            if end - start < 2:
+                continue
+            inner = points[start + 1:end]
+            direction = points[end] - points[start]
+            norm = np.linalg.norm(direction)
+            relative = inner - points[start]
+            if norm > 0:
+                deviation = np.abs(direction[0] * relative[:, 1] - direction[1] * relative[:, 0]) / norm
+            else:
+                deviation = np.linalg.norm(relative, axis=1)
+            farthest = int(np.argmax(deviation))
+            if deviation[farthest] > tolerance or not is_free:
+                split = start + 1 + farthest
+                keep[split] = True
+                spans += [(start, split), (split, end)]
+    return np.flatnonzero(keep).tolist()
+
+
+def smooth_spline(path, index, n_points=100, max_refinements=5):
+    """ Fits a cubic spline through the waypoints and samples it at n_points points, evenly spaced along the path.
+        Where the sampled spline hits an obstacle, the waypoints around it are doubled (the spline then hugs
+        the straight segments more tightly) and the spline is fitted again, up to max_refinements times.
+
+        Returns the sampled spline as an (n_points, 2) array, or None if it still collides.
+    """
+    points = _as_points(path)
+    if len(points) < 3:
+        return points
+    for _ in range(max_refinements + 1):
+        along = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))])
+        along /= along[-1]
+        tck, _ = splprep(points.T, u=along, k=min(3, len(points) - 1), s=0)
+        samples = np.column_stack(splev(np.linspace(0, 1, n_points), tck))
+        # the spline evaluation is off by rounding errors at the ends
+        samples[0], samples[-1] = points[0], points[-1]
+        hit = ~segments_free(np.stack([samples[:-1], samples[1:]], axis=1), index)
+        if not hit.any():
+            return samples
+        # waypoint segments under the colliding parts of the spline, and their neighbors
+        u = np.linspace(0, 1, n_points)
+        segment = np.clip(np.searchsorted(along, u[:-1][hit], side="right") - 1, 0, len(points) - 2)
+        segment = np.unique(np.concatenate([segment - 1, segment, segment + 1]).clip(0, len(points) - 2))
+        midpoints = (points[segment] + points[segment + 1]) / 2
+        points = np.insert(points, segment + 1, midpoints, axis=0)
+    return None
+
+
+def postprocess(path, obstacles=None, index=None, shortcut="greedy", tolerance=None, spline=False, n_points=100,
+                seed=None):
+    """ Shortens and simplifies a path.
+
+        path: list of points from the start to the goal
+        obstacles, index: the obstacles, or a prebuilt `collision.ObstacleIndex` of them
+        shortcut: "greedy" (`shortcut_greedy`), "random" (`shortcut_random`) or None
+        tolerance: if given, the path is first simplified with `downsample`, which is cheaper than the
+                   shortcutting on the dense paths of the potential field. The shortcuts can then only join
+                   the kept waypoints, so leave it out for the short paths of the graph planners
+        spline: also fit a collision free spline with n_points points (`smooth_spline`), the path is kept as
+                a polyline if the spline cannot avoid the obstacles
+        seed: seed of the random shortcutting
+
+        Returns:
+            path: list of (x, y) points, with the same start and goal. A path with fewer than 2 points is
+                  returned unchanged.
+            report: dictionary with the number of waypoints before and after ("waypoints_in",
+                    "waypoints_out"), the number removed by each step, the length before and after and the
+                    time it took in seconds.
+    """
+    start = time.perf_counter()
+    points = np.asarray(path, dtype=float).reshape(-1, 2)
+    report = {"waypoints_in": len(points), "length_in": path_length(points)}
+    if len(points) < 2:
+        # nothing to shorten, like the empty path of a failed plan
+        report.update(spline=None, waypoints_out=len(points), removed={}, length_out=report["length_in"],
+                      time=time.perf_counter() - start)
+        return path, report
+    if index is None:
+        index = ObstacleIndex(obstacles)
+    removed = {}
+
+    n = len(points)
+    points = _as_points(points)
+    removed["duplicates"] = n - len(points)
+    if tolerance is not None:
+        n = len(points)
+        with instrumentation.timer("path_smoothing.downsample"):
+            points = points[downsample(points, index, tolerance)]
+        removed["downsample"] = n - len(points)
+    if shortcut is not None:
+        n = len(points)
+        with instrumentation.timer("path_smoothing.shortcut"):
+            if shortcut == "greedy":
+                points = points[shortcut_greedy(points, index)]
+            elif shortcut == "random":
+                points = shortcut_random(points, index, seed=seed)
+            else:
+                raise ValueError(f"Unknown shortcutting: {shortcut}")
+        removed["shortcut"] = n - len(points)
+    report["spline"] = None
+    if spline:
+        with instrumentation.timer("path_smoothing.spline"):
+            samples = smooth_spline(points, index, n_points)
+        report["spline"] = samples is not None
+        if samples is not None:
+            points = samples
+
+    report.update(waypoints_out=len(points), removed=removed, length_out=path_length(points),
+                  time=time.perf_counter() - start)
+    instrumentation.count("path_smoothing.removed", report["waypoints_in"] - len(points))
+    return [tuple(point) for point in points.tolist()], report
@@ -1,6 +1,10 @@
 """Plots the environment for path planning"""
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.collections import LineCollection
+
+import instrumentation
+from graph import Graph
 
 def plot_environment(ax, start, end, obstacles, limits, algorithm):
     """ Plots the start and end point, as well as the path, 
@@ -29,7 +33,12 @@ def plot_path(ax, path):
 
 
 def plot_graph(ax, graph):
-    """Plots the graph"""
+    """Plots the graph, a dictionary or a `graph.Graph`"""
+    if isinstance(graph, Graph):
+        # all the edges in a single collection, a line per edge is too slow for large roadmaps
+        i, j, _ = graph.edges()
+        ax.add_collection(LineCollection(np.stack([graph.nodes[i], graph.nodes[j]], axis=1), colors='k', alpha=0.05))
+        return ax
     for vertex in graph:
         for other_vertex in graph[vertex]:
             ax.plot([vertex[0], other_vertex[0]], [vertex[1], other_vertex[1]], 'k', alpha=0.05)
@@ -38,30 +47,23 @@ def plot_graph(ax, graph):
 
 def plot_field(ax, f, limits):
     """Plots the potential field
-    f: function that returns the force vector at a given point"""
+    f: function that returns the force vectors at an (N, 2) array of points"""
     x = np.linspace(limits[0][0], limits[2][0], 20)
     y = np.linspace(limits[0][1], limits[1][1], 20)
-    print("x: and y: ", x, y)
     X, Y = np.meshgrid(x, y)
-    U = np.zeros_like(X)
-    V = np.zeros_like(Y)
-    for i in range(len(x)):
-        for j in range(len(y)):
-            force = - np.sum(f((x[i], y[j])), axis=0) 
-            force = force / np.linalg.norm(force)
-            U[j, i] = force[0] 
-            V[j, i] = force[1]
+    # evaluate the force at all the grid points in one call
+    force = - np.sum(f(np.column_stack([X.ravel(), Y.ravel()])), axis=0)
+    force = force / np.linalg.norm(force, axis=1, keepdims=True)
+    U = force[:, 0].reshape(X.shape)
+    V = force[:, 1].reshape(Y.shape)
     ax.quiver(X, Y, U, V, color="C0", alpha=0.5, scale=10, scale_units="inches", label="Force field") 
-    print("Force field plotted. Close the plot to continue. ")
+    instrumentation.event("plot.force_field", points=X.size)
     return ax
 
 def plot_decomposition(ax, decomposition):
-    for polygon in decomposition[:-1]:
-        # find all the vertex of the polygon that has the highest y value with sorting
-        vertex_arr = sorted(polygon, key=lambda x: x[1], reverse=True)
-        # all vertices with the max y value
-        max_y = [vertex for vertex in vertex_arr if vertex[1] == vertex_arr[0][1]]
-        # plot a line between the all the vertices with the max y value
-        for i in range(len(max_y) - 1):
-            ax.plot([max_y[i][0], max_y[i + 1][0]], [max_y[i][1], max_y[i + 1][1]], 'k')
+    # outline of each trapezoid, the obstacle and boundary sides are drawn over by plot_environment
+    for cell in decomposition:
+        xs = [vertex[0] for vertex in cell] + [cell[0][0]]
+        ys = [vertex[1] for vertex in cell] + [cell[0][1]]
+        ax.plot(xs, ys, 'k', linewidth=0.5)
     return ax
\ No newline at end of file
@@ -1,84 +1,317 @@
+import logging
+
 import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+import instrumentation
+from collision import ObstacleIndex, pack_edges
 
-def potential_field(p0, pf, obstacles):
+def potential_field(p0, pf, obstacles, psi=1, eta=1, threshold=0.5, alpha=0.01, tolerance=0.1, max_steps=2000,
+                    limits=None, grid_resolution=None, repulsion="exact", sdf_resolution=0.05):
     """ Creates a potential field by summing the repulsive and attractive fields.
         The attractive field is a quadratic function of the distance to the goal.
         The repulsive field is a function of the distance to the obstacles.
+
+        psi, eta: gains of the attractive and repulsive forces
+        threshold: distance to the obstacles beyond which there is no repulsion
+        alpha: step size of the gradient descent
+        tolerance: distance to pf at which the goal is reached
+        max_steps: number of steps before giving up
+        limits, grid_resolution: if a resolution is given, the repulsive force is precomputed on a grid
+            with that spacing over the limits (see `ForceGrid`) and interpolated at each step
+        repulsion: how the distance to the obstacles is computed. "exact" uses the distance to every
+            obstacle edge, "sdf" a signed distance field rasterized with sdf_resolution over the limits
+            (see `SignedDistanceField`), "sampled" the closest of 10 points sampled on each edge
+
+        Returns the force function, which takes one (2,) point or an (N, 2) array of points and returns
+        the attractive and repulsive forces, and the path as a list of points.
+    """
+    p0 = np.array(p0, dtype=float)
+    pf = np.array(pf, dtype=float)
+    if limits is None:
+        corners = np.vstack([np.array([v for obstacle in obstacles for v in obstacle], dtype=float).reshape(-1, 2), p0, pf])
+        lower, upper = corners.min(axis=0) - threshold, corners.max(axis=0) + threshold
+    else:
+        # bottom-left and top-right corners of the workspace
+        lower, upper = limits[0], limits[2]
+
+    if repulsion == "exact":
+        edges = pack_edges(obstacles)
+        f_rep = lambda p: repulsive_force_exact(p, edges, eta, threshold)
+    elif repulsion == "sdf":
+        sdf = SignedDistanceField(obstacles, lower, upper, sdf_resolution)
+        f_rep = lambda p: sdf.repulsive_force(p, eta, threshold)
+    elif repulsion == "sampled":
+        obs_points = sample_obstacle_points(obstacles)
+        f_rep = lambda p: repulsive_force(p, obs_points, eta, threshold)
+    else:
+        raise ValueError(f"Unknown repulsion: {repulsion}")
+
+    if grid_resolution is not None:
+        f_rep = ForceGrid(f_rep, lower, upper, grid_resolution)
+
+    def total_f(p):
+        # potential field force
+        p = np.asarray(p, dtype=float)
+        return attractive_force(p, pf, psi), f_rep(p)
+
+    with instrumentation.timer("potential_field.descend"):
+        paths, reached = descend(p0[np.newaxis], pf, total_f, alpha, tolerance, max_steps)
+    path = list(paths[0])
+    if not reached[0]:
+        instrumentation.event("potential_field.no_path", level=logging.WARNING, steps=len(path))
+        return total_f, path
+
+    instrumentation.event("potential_field.path_found", steps=len(path))
+    return total_f, path
+
+
+def sample_obstacle_points(obstacles, points_per_edge=10):
+    """ Samples points along the edges of the obstacles.
+        Returns an (P, 3) array with the x, y coordinates and the id of the obstacle of each point.
     """
-    p0 = np.array(p0)
-    pf = np.array(pf)
-    # attractive force 
-    psi = 1  # scaling factor
-    f_att = lambda p: - psi*(pf - p)/np.linalg.norm(pf - p)
-
-    # include the edges of the obstacles
-    obs_points = np.array([]).reshape(0, p0.shape[0] + 1)
-    for jj, obstacle in enumerate(obstacles):
-        # add final point to close the polygon
-        obstacle = np.vstack([obstacle, obstacle[0]])
-        for ii in range(len(obstacle) - 1):
-            segment = np.linspace(obstacle[ii], obstacle[(ii + 1)], 10)[:-1]
-            # add the obstacle id to the points
-            segment = np.hstack([segment, np.ones((len(segment), 1)) * jj])
-            obs_points = np.vstack([obs_points, segment])
-
-    def repulsive_force(p):
-        eta = 1  # scaling factor
+    edges = pack_edges(obstacles)
+    ids = np.repeat(np.arange(len(obstacles)), [len(obstacle) for obstacle in obstacles])
+    # the last point of each edge is the first one of the next edge
+    s = np.linspace(0, 1, points_per_edge)[:-1, np.newaxis]
+    points = edges[:, np.newaxis, 0] + s * (edges[:, np.newaxis, 1] - edges[:, np.newaxis, 0])
+    return np.column_stack([points.reshape(-1, 2), np.repeat(ids, points_per_edge - 1)])
+
+
+def attractive_force(p, pf, psi=1):
+    """ Attractive force towards pf at the (2,) point or (N, 2) points p, with unit magnitude times psi"""
+    return - psi*(pf - p)/np.linalg.norm(pf - p, axis=-1, keepdims=True)
 
+
+def repulsive_force(p, obs_points, eta=1, threshold=0.5, chunk=4096):
+    """ Repulsive force from the closest obstacle point at the (2,) point or (N, 2) points p"""
+    points = np.asarray(p, dtype=float).reshape(-1, 2)
+    f = np.zeros_like(points)
+    for start in range(0, len(points), chunk):
+        batch = points[start:start + chunk]
         # argmin of the distance to the obstacles
-        idx = np.argmin(np.linalg.norm(p - obs_points[:, :2], axis=1))
+        delta = batch[:, np.newaxis] - obs_points[np.newaxis, :, :2]
+        distances = np.sqrt(delta[..., 0]**2 + delta[..., 1]**2)
+        idx = np.argmin(distances, axis=1)
+        d = distances[np.arange(len(batch)), idx][:, np.newaxis]
         closest_point = obs_points[idx, :2]
-        d = np.linalg.norm(p - closest_point)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            force = - eta * (1/d - 1/threshold) * (1/d**2) * (batch - closest_point)
+        f[start:start + chunk] = np.where(d > threshold, 0.0, force)
+    return f.reshape(np.shape(p))
+
+
+class ForceGrid:
+    """ Force field precomputed on a regular grid and bilinearly interpolated, so each lookup is O(1).
+
+        f: function that takes an (N, 2) array of points and returns an (N, 2) array of forces
+        lower, upper: bottom-left and top-right corners of the grid
+        resolution: spacing of the grid
+    """
+
+    def __init__(self, f, lower, upper, resolution):
+        self.lower = np.array(lower, dtype=float)
+        upper = np.array(upper, dtype=float)
+        self.resolution = resolution
+        self.shape = tuple(np.ceil((upper - self.lower) / resolution).astype(int) + 1)
+        x = self.lower[0] + resolution * np.arange(self.shape[0])
+        y = self.lower[1] + resolution * np.arange(self.shape[1])
+        X, Y = np.meshgrid(x, y, indexing="ij")
+        self.values = f(np.column_stack([X.ravel(), Y.ravel()])).reshape(self.shape + (2,))
+
+    def __call__(self, p):
+        return bilinear(self.values, self.lower, self.resolution, p)
+
+
+def bilinear(values, lower, resolution, p):
+    """ Bilinear interpolation at the (2,) point or (N, 2) points p of the values sampled on a regular grid.
+        values: (nx, ny) or (nx, ny, k) array, values[i, j] is the value at lower + resolution * (i, j).
+        The points outside of the grid get the value at its edge.
+    """
+    points = np.asarray(p, dtype=float).reshape(-1, 2)
+    shape = np.array(values.shape[:2])
+    position = np.clip((points - lower) / resolution, 0, shape - 1)
+    cell = np.maximum(np.minimum(np.floor(position).astype(int), shape - 2), 0)
+    t = position - cell
+    tx, ty = t[:, 0], t[:, 1]
+    if values.ndim == 3:
+        tx, ty = tx[:, np.newaxis], ty[:, np.newaxis]
+    i, j = cell[:, 0], cell[:, 1]
+    i1, j1 = np.minimum(i + 1, shape[0] - 1), np.minimum(j + 1, shape[1] - 1)
+    f = ((1 - tx) * (1 - ty) * values[i, j] + tx * (1 - ty) * values[i1, j] +
+         (1 - tx) * ty * values[i, j1] + tx * ty * values[i1, j1])
+    return f.reshape(np.shape(p)[:-1] + values.shape[2:])
+
+
+def closest_points(p, edges, chunk=4096):
+    """ Exact distance from each point to the closest obstacle edge, and the closest point on that edge.
+        p: (N, 2) points, edges: (E, 2, 2) array of edges (see `collision.pack_edges`)
+        Returns the (N,) distances and the (N, 2) closest points.
+    """
+    points = np.asarray(p, dtype=float).reshape(-1, 2)
+    distance = np.full(len(points), np.inf)
+    closest = np.zeros_like(points)
+    if len(edges) == 0:
+        return distance, closest
+    a = edges[np.newaxis, :, 0]
+    ab = edges[np.newaxis, :, 1] - edges[np.newaxis, :, 0]
+    ab_squared = np.maximum(np.sum(ab**2, axis=2), 1e-300)
+    batch_size = max(1, chunk * 64 // max(len(edges), 1))
+    for start in range(0, len(points), batch_size):
+        batch = points[start:start + batch_size, np.newaxis]
+        # projection of the point on each edge, clamped to the end points
+        s = np.clip(np.sum((batch - a) * ab, axis=2) / ab_squared, 0, 1)
+        projection = a + s[..., np.newaxis] * ab
+        delta = batch - projection
+        d_squared = delta[..., 0]**2 + delta[..., 1]**2
+        idx = np.argmin(d_squared, axis=1)
+        rows = np.arange(len(idx))
+        distance[start:start + batch_size] = np.sqrt(d_squared[rows, idx])
+        closest[start:start + batch_size] = projection[rows, idx]
+    return distance, closest
+
+
+def _distance_to_edges(points, edges):
+    """ Distance from each of the (N, 2) points to the closest of its own (N, K, 2, 2) edges"""
+    a = edges[:, :, 0]
+    ab = edges[:, :, 1] - a
+    ap = points[:, np.newaxis] - a
+    s = np.clip(np.sum(ap * ab, axis=2) / np.maximum(np.sum(ab**2, axis=2), 1e-300), 0, 1)
+    delta = ap - s[..., np.newaxis] * ab
+    return np.sqrt(np.min(delta[..., 0]**2 + delta[..., 1]**2, axis=1))
+
+
+def repulsive_force_exact(p, edges, eta=1, threshold=0.5):
+    """ Repulsive force from the closest point of the obstacle edges at the (2,) point or (N, 2) points p"""
+    points = np.asarray(p, dtype=float).reshape(-1, 2)
+    d, closest_point = closest_points(points, edges)
+    d = d[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f = - eta * (1/d - 1/threshold) * (1/d**2) * (points - closest_point)
+    return np.where(d > threshold, 0.0, f).reshape(np.shape(p))
+
+
+class SignedDistanceField:
+    """ Signed distance to the obstacles rasterized over the workspace, positive outside of the obstacles.
+
+        A Euclidean distance transform of the rasterized obstacles finds the closest obstacle to each node,
+        then the exact distance to the edges of that obstacle alone is stored. After that each query is a bilinear
+        interpolation that does not depend on the number of obstacles.
+        obstacles: list of convex obstacles
+        lower, upper: bottom-left and top-right corners of the raster
+        resolution: spacing of the raster nodes
+    """
+
+    def __init__(self, obstacles, lower, upper, resolution, chunk=2 ** 16):
+        self.resolution = resolution
+        self.lower = np.array(lower, dtype=float)
+        upper = np.array(upper, dtype=float)
+        shape = tuple(np.ceil((upper - self.lower) / resolution).astype(int) + 1)
+        x = self.lower[0] + resolution * np.arange(shape[0])
+        y = self.lower[1] + resolution * np.arange(shape[1])
+        X, Y = np.meshgrid(x, y, indexing="ij")
+        nodes = np.column_stack([X.ravel(), Y.ravel()])
+        index = ObstacleIndex(obstacles)
+        label = index.locate(nodes).reshape(shape)
+        occupied = label >= 0
 
-        threshold = 0.5
-        if d > threshold:
-            f = np.zeros(2)
+        if len(index.edges):
+            # the node closest to each vertex is a seed of its obstacle too, so thin obstacles that fall
+            # between the nodes are not missed, then every node takes the obstacle of its closest seed
+            seeds = label.copy()
+            vertex = np.clip(np.rint((index.edges[:, 0] - self.lower) / resolution).astype(int), 0, np.array(shape) - 1)
+            free_vertex = seeds[vertex[:, 0], vertex[:, 1]] < 0
+            seeds[vertex[free_vertex, 0], vertex[free_vertex, 1]] = index.edge_obstacle[free_vertex]
+            _, (ii, jj) = distance_transform_edt(seeds < 0, return_indices=True)
+            closest_obstacle = seeds[ii, jj].ravel()
+            sizes = np.diff(index.obstacle_start)
+            distance = np.zeros(len(nodes))
+            for start in range(0, len(nodes), chunk):
+                # edges of the closest obstacle of each node, padded with its last edge up to the largest obstacle
+                obstacle = closest_obstacle[start:start + chunk, np.newaxis]
+                edge_ids = index.obstacle_start[obstacle] + np.minimum(np.arange(sizes.max()), sizes[obstacle] - 1)
+                distance[start:start + chunk] = _distance_to_edges(nodes[start:start + chunk], index.edges[edge_ids])
+            self.distance = np.where(occupied.ravel(), -distance, distance).reshape(shape)
+            gradient = np.stack(np.gradient(self.distance, resolution), axis=-1)
+            norm = np.linalg.norm(gradient, axis=-1, keepdims=True)
+            self.gradient = np.divide(gradient, norm, out=np.zeros_like(gradient), where=norm > 0)
         else:
-            f =  - eta * (1/d - 1/threshold) * (1/d**2) * (p - closest_point)
-            #print(f"p: {p}, closest_point: {closest_point}, d: {d}")
+            # far enough from everything, and still finite for the interpolation
+            self.distance = np.full(shape, 1e300)
+            self.gradient = np.zeros(shape + (2,))
 
-        return f
+    def __call__(self, p):
+        """ Signed distance at the (2,) point or (N, 2) points p"""
+        return bilinear(self.distance, self.lower, self.resolution, p)
+
+    def repulsive_force(self, p, eta=1, threshold=0.5):
+        """ Repulsive force at the (2,) point or (N, 2) points p, pushing along the distance gradient"""
+        points = np.asarray(p, dtype=float).reshape(-1, 2)
+        d = self(points)[:, np.newaxis]
+        direction = bilinear(self.gradient, self.lower, self.resolution, points)
+        # p - closest_point is d times the unit gradient of the distance
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f = - eta * (1/d - 1/threshold) * (1/d) * direction
+        return np.where(d > threshold, 0.0, f).reshape(np.shape(p))
+
+
+def descend(starts, pf, total_f, alpha=0.01, tolerance=0.1, max_steps=2000):
+    """ Runs the gradient descent from many start points at once.
+
+        starts: (N, 2) array of start points
+        total_f: function returning the attractive and repulsive forces at an (N, 2) array of points
+
+        Returns a list with the path of each start point as an (L, 2) array, and an (N,) boolean
+        array that is True for the paths that reached pf.
+    """
+    starts = np.asarray(starts, dtype=float).reshape(-1, 2)
+    n = len(starts)
+    history = np.zeros((max_steps + 1, n, 2))
+    history[0] = starts
+    length = np.ones(n, dtype=int)
+    count = np.zeros(n, dtype=int)
+    p = starts.copy()
+    active = np.linalg.norm(p - pf, axis=1) > tolerance
+
+    step = 0
+    ids = np.flatnonzero(active)
+    while len(ids) and step < max_steps:
+        p_ids = p[ids]
+        fa, fr = total_f(p_ids)
+        new_p = p_ids - alpha * (fa + fr)
 
-    def total_f(p):
-        # potential field force
-        f_rep = repulsive_force(np.array(p))
-        f_attr = f_att(p)
-        #print(f"repulsive force: {f_rep} and attractive force: {f_attr}")
-        return f_attr, f_rep
-
-    # perform gradient descent to find the path
-    alpha = 0.01  # step size
-    path = [p0]
-    p = p0
-    count = 0
-    while np.linalg.norm(p - pf) > 0.1:
         #if there is no progress, move perpendicular to the force
-        if len(path) > 5:
-            prev_path_array = np.array(path[-5:-1])
+        if step >= 5:
             # if the last 5 points are close to each other, we are stuck
-            displacement = 0
-            for i in range(3):
-                displacement += np.linalg.norm(prev_path_array[i] - prev_path_array[i + 1])
-            if displacement < 0.1/10 and count < 10: 
-                print(f"No progress, displacement in the last 5 steps is {displacement}.\nMoving perpendicular to the repulsive force")
-                fa, fr = total_f(p)
-                fr = np.array([-fr[1], fr[0]])
-                fr = fr / np.linalg.norm(fr) if np.linalg.norm(fr) > 0 else fr
-                p = p + (fa+0.5*fr) * 0.1
-                count += 1
-            else:
-                p = p - alpha * np.sum(total_f(p), axis=0)
-            if count == 10:
-                print("Going too far from the path")
-                count = 0
-        else:
-            p = p - alpha * np.sum(total_f(p), axis=0)
-        path.append(p)
-        #print(f"p: {p}")
-        #print("len(path): ", len(path))
-        if len(path) > 2000:
-            print("No path found")
-            return total_f, path
-
-    print(f"Path found using potential field! in {len(path)} steps.")
-    return total_f, path
+            prev_path_array = history[step - 4:step, ids]
+            steps = prev_path_array[1:] - prev_path_array[:-1]
+            displacement = np.sqrt(steps[..., 0]**2 + steps[..., 1]**2).sum(axis=0)
+            stuck = (displacement < 0.1/10) & (count[ids] < 10)
+            if stuck.any():
+                perpendicular = np.column_stack([-fr[stuck, 1], fr[stuck, 0]])
+                norm = np.linalg.norm(perpendicular, axis=1, keepdims=True)
+                perpendicular = np.divide(perpendicular, norm, out=perpendicular, where=norm > 0)
+                new_p[stuck] = p_ids[stuck] + (fa[stuck] + 0.5*perpendicular) * 0.1
+                count[ids[stuck]] += 1
+                n_stuck = int(stuck.sum())
+                instrumentation.count("potential_field.stuck_escapes", n_stuck)
+                instrumentation.event("potential_field.stuck", level=logging.DEBUG, step=step, points=n_stuck,
+                                      displacement=float(displacement[stuck].min()))
+            # going too far from the path
+            too_far = ids[count[ids] == 10]
+            if len(too_far):
+                instrumentation.count("potential_field.escape_resets", len(too_far))
+            count[too_far] = 0
+
+        p[ids] = new_p
+        step += 1
+        history[step, ids] = new_p
+        length[ids] += 1
+        to_goal = new_p - pf
+        active[ids] = np.sqrt(to_goal[:, 0]**2 + to_goal[:, 1]**2) > tolerance
+        ids = np.flatnonzero(active)
+
+    instrumentation.count("potential_field.iterations", step)
+    instrumentation.count("potential_field.point_updates", int(length.sum()) - n)
+    paths = [history[:length[k], k] for k in range(n)]
+    return paths, ~active
@@ -1,50 +1,96 @@
 import numpy as np
+from scipy.spatial import cKDTree
 
-from visibility_graph import is_line_intersecting
+import instrumentation
+from collision import ObstacleIndex
+from graph import Graph
 
-def PRM(p0, pf, obstacles, limits):
+def PRM(p0, pf, obstacles, limits, n_samples=50, k=10, radius=None, seed=None, index=None, as_graph=False):
     """ Probabilistic Roadmap Method
         p0: start point
         pf: end point
         obstacles: list of obstacles, each obstacle is a list of vertices
         limits: boundary of the workspace
+        n_samples: number of points sampled in the workspace, the ones inside obstacles are dropped
+        k: number of nearest neighbors each vertex tries to connect to. With the default 50 samples, fewer
+           neighbors leave the roadmap disconnected in a few percent of the runs
+        radius: if given, connect to every vertex closer than radius instead of the k nearest.
+                Use "auto" for the PRM* radius that shrinks with the number of samples
+        seed: seed of the random number generator, for reproducible roadmaps
+        index: optional prebuilt `collision.ObstacleIndex` of the obstacles
+        as_graph: return a `graph.Graph` instead of a dictionary, without building a tuple per sample
     """
-    graph = {}
-    # add the start and end points to the graph
-    graph[p0] = {}
-    graph[pf] = {}
-    # add the limits to the graph
-    for limit in limits:
-        graph[limit] = {}
-    sampled_points = 50
-    for i in range(sampled_points):
-        # sample a point in the workspace
-        sample = np.random.uniform(limits[0], limits[2])
-        if not is_inside_obstacle(sample, obstacles):
-            graph[tuple(sample)] = {}
-            # connect it to the k-nearest neighbors
-            k = 5
-            distances = {}
-            for vertex in graph:
-                distances[vertex] = np.linalg.norm(sample - vertex)
-            distances = {k: v for k, v in sorted(distances.items(), key=lambda item: item[1])}
-            for vertex in list(distances.keys())[1:k]:
-                if not is_line_intersecting(vertex, tuple(sample), obstacles):
-                    graph[tuple(sample)][vertex] = distances[vertex]
-                    graph[vertex][tuple(sample)] = distances[vertex]
+    if index is None:
+        index = ObstacleIndex(obstacles)
+    rng = np.random.default_rng(seed)
+
+    # the start and end points and the limits are vertices of the graph too
+    with instrumentation.timer("prm.sample"):
+        samples = sample_free(limits, n_samples, index, rng)
+    coords = np.vstack([np.array([p0, pf] + list(limits), dtype=float), samples])
+
+    if radius == "auto":
+        radius = prm_star_radius(len(coords), limits)
+    with instrumentation.timer("prm.connect"):
+        i, j, distances = connect_neighbors(coords, index, k=k, radius=radius)
+    instrumentation.count("graph.nodes", len(coords))
+    instrumentation.count("graph.edges", len(i))
+    if as_graph:
+        return Graph.from_edges(coords, i, j, distances)
+
+    vertices = [p0, pf] + list(limits) + list(map(tuple, samples.tolist()))
+
+    graph = {vertex: {} for vertex in vertices}
+    for a, b, distance in zip(i.tolist(), j.tolist(), distances.tolist()):
+        graph[vertices[a]][vertices[b]] = distance
+        graph[vertices[b]][vertices[a]] = distance
     return graph
 
 
-def is_inside_obstacle(point, obstacles):
-    """ Checks if a point is inside the obstacles. 
-        The obstacles are defined by the vertices of a convex polygon."""
-    def ccw(A, B, C):
-        return (C[1]-A[1]) * (B[0]-A[0]) > (B[1]-A[1]) * (C[0]-A[0])
-    for obstacle in obstacles:
-        for i in range(len(obstacle)):
-            p1 = obstacle[i]
-            p2 = obstacle[(i + 1) % len(obstacle)]
-            p3 = point
-            if ccw(p1, p2, p3) != ccw(p1, p2, obstacle[0]):
-                return False 
-    return True 
+def sample_free(limits, n_samples, index, rng):
+    """ Samples n_samples points in the workspace at once and drops the ones inside the obstacles"""
+    samples = rng.uniform(limits[0], limits[2], (n_samples, 2))
+    return samples[~index.points_inside(samples)]
+
+
+def prm_star_radius(n_vertices, limits):
+    """ Connection radius of PRM*, gamma * sqrt(log(n) / n), with gamma just above the bound that
+        keeps the roadmap asymptotically optimal in the plane"""
+    area = abs((limits[2][0] - limits[0][0]) * (limits[2][1] - limits[0][1]))
+    gamma = 2 * np.sqrt(1.5) * np.sqrt(area / np.pi) * 1.1
+    return gamma * np.sqrt(np.log(max(n_vertices, 2)) / max(n_vertices, 2))
+
+
+def connect_neighbors(coords, index, k=5, radius=None, check=True):
+    """ Finds the collision free edges between each vertex and its neighbors with a KD-tree.
+        With check=False every candidate edge is returned without collision checking, for the lazy roadmaps
+        that only check the edges of the paths they find (see `roadmap.Roadmap.prm`).
+
+    Returns:
+        i, j: arrays with the vertex indices of each edge (i < j, every edge listed once).
+        distances: array with the length of each edge.
+    """
+    tree = cKDTree(coords)
+    if radius is not None:
+        pairs = tree.query_pairs(radius, output_type="ndarray")
+    else:
+        k = min(k, len(coords) - 1)
+        if k < 1:
+            pairs = np.zeros((0, 2), dtype=np.int64)
+        else:
+            # the closest point to each vertex is itself
+            _, neighbors = tree.query(coords, k=k + 1)
+            i = np.repeat(np.arange(len(coords)), k)
+            j = neighbors[:, 1:].ravel()
+            # one int64 key per pair, much faster to deduplicate than the rows of a 2-column array, and
+            # sorting the keys to drop the repeats is faster than np.unique
+            key = np.sort(np.minimum(i, j) * len(coords) + np.maximum(i, j))
+            key = key[np.concatenate([[True], key[1:] != key[:-1]])]
+            pairs = np.column_stack([key // len(coords), key % len(coords)])
+    pairs = pairs.reshape(-1, 2)
+    segments = coords[pairs]
+    distances = np.linalg.norm(segments[:, 0] - segments[:, 1], axis=1)
+    if not check:
+        return pairs[:, 0], pairs[:, 1], distances
+    free = ~index.segments_intersect(segments)
+    return pairs[free, 0], pairs[free, 1], distances[free]
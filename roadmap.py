@@ -0,0 +1,306 @@
+""" Roadmap built once for a static map and reused for many start and goal queries.
+
+    The roadmap is stored as plain arrays (vertices and a compressed sparse row graph) that are saved
+    as .npy files in a folder, so they can be loaded back memory-mapped without unpickling anything.
+
+    A lazy PRM roadmap (`Roadmap.prm` with lazy=True) keeps its candidate edges without checking them.
+    Each query searches the roadmap as if all the unchecked edges were free, checks the edges of the path it
+    finds, drops the ones that collide and searches again, until the path only uses free edges. The status
+    of the checked edges is kept, so the next queries do not check them again.
+"""
+import json
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import instrumentation
+from collision import ObstacleIndex
+from dijkstra import dijkstra_csr, path_from_predecessors
+from graph import Graph, edges_to_csr
+from prm import connect_neighbors, prm_star_radius, sample_free
+from visibility_graph import visibility_edges
+
+_ARRAYS = ("nodes", "indptr", "indices", "weights", "obstacle_vertices", "obstacle_start", "limits")
+
+# status of the edges of a lazy roadmap
+UNKNOWN, FREE, BLOCKED = 0, 1, -1
+
+
+class Roadmap:
+    """ Roadmap of a static map that answers many (p0, pf) queries.
+
+        Build it with `Roadmap.prm` or `Roadmap.visibility`, then call `query` for each start and goal.
+        Each query only connects p0 and pf to the roadmap, the roadmap itself is never rebuilt.
+    """
+
+    def __init__(self, nodes, indptr, indices, weights, obstacles, limits, kind, k=5, status=None):
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.obstacles = obstacles
+        self.limits = limits
+        self.kind = kind
+        self.k = k
+        # lazy roadmaps only: status of each CSR entry (UNKNOWN, FREE or BLOCKED), the blocked edges have
+        # an infinite weight so the searches never use them
+        self.status = status
+        self._index = None
+        self._tree = None
+        self._longest = None
+
+    @classmethod
+    def prm(cls, obstacles, limits, n_samples=1000, k=5, radius=None, seed=None, index=None, lazy=False):
+        """ Probabilistic roadmap of the free space, see `prm.PRM` for the parameters.
+            lazy: keep every candidate edge unchecked, the queries check the edges of their paths only.
+                  It only saves the collision checks, the sampling, the KD-tree neighbor search and the CSR
+                  arrays cost the same: the build is about 2x faster with k=8 and 6x with the PRM* radius,
+                  which has more candidate edges (`benchmarks.bench_lazy_prm`)"""
+        index = index if index is not None else ObstacleIndex(obstacles)
+        rng = np.random.default_rng(seed)
+        nodes = np.vstack([np.array(limits, dtype=float), sample_free(limits, n_samples, index, rng)])
+        if radius == "auto":
+            radius = prm_star_radius(len(nodes), limits)
+        i, j, distances = connect_neighbors(nodes, index, k=k, radius=radius, check=not lazy)
+        indptr, indices, weights = edges_to_csr(len(nodes), i, j, distances)
+        status = np.full(len(indices), UNKNOWN, dtype=np.int8) if lazy else None
+        roadmap = cls(nodes, indptr, indices, weights, obstacles, limits, "prm", k, status)
+        roadmap._index = index
+        return roadmap
+
+    @property
+    def lazy(self):
+        return self.status is not None
+
+    @classmethod
+    def visibility(cls, obstacles, limits, index=None, workers=1):
+        """ Visibility graph between the obstacle vertices and the limits, see `visibility_graph.visibility_graph`"""
+        index = index if index is not None else ObstacleIndex(obstacles)
+        nodes = np.array([vertex for obstacle in obstacles for vertex in obstacle] + list(limits), dtype=float)
+        # every obstacle has as many edges as vertices, so the obstacle of each edge is the one of its first vertex
+        obstacle_of = np.concatenate([index.edge_obstacle, -np.ones(len(limits), dtype=np.int64)])
+        i, j, distances = visibility_edges(nodes, obstacle_of, index, workers)
+        roadmap = cls(nodes, *edges_to_csr(len(nodes), i, j, distances), obstacles, limits, "visibility")
+        roadmap._index = index
+        return roadmap
+
+    @property
+    def graph(self):
+        """ The roadmap as a `graph.Graph`, sharing its arrays. The unchecked edges of a lazy roadmap are
+            included, the blocked ones have an infinite weight."""
+        return Graph(self.nodes, self.indptr, self.indices, self.weights)
+
+    @property
+    def index(self):
+        """ Obstacle index used by the queries, built on first use after loading"""
+        if self._index is None:
+            self._index = ObstacleIndex(self.obstacles)
+        return self._index
+
+    def save(self, folder):
+        """ Saves the roadmap to a folder with one .npy file per array and a small json header"""
+        os.makedirs(folder, exist_ok=True)
+        sizes = [len(obstacle) for obstacle in self.obstacles]
+        arrays = {
+            "nodes": self.nodes, "indptr": self.indptr, "indices": self.indices, "weights": self.weights,
+            "obstacle_vertices": np.array([v for obstacle in self.obstacles for v in obstacle], dtype=float).reshape(-1, 2),
+            "obstacle_start": np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64),
+            "limits": np.array(self.limits, dtype=float),
+        }
+        for name in _ARRAYS:
+            np.save(os.path.join(folder, name + ".npy"), arrays[name])
+        if self.lazy:
+            np.save(os.path.join(folder, "status.npy"), self.status)
+        with open(os.path.join(folder, "roadmap.json"), "w") as f:
+            json.dump({"kind": self.kind, "k": self.k, "lazy": self.lazy}, f)
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        """ Loads a roadmap saved with `save`. With mmap the graph arrays are memory-mapped, not read.
+            The weights and edge status of a lazy roadmap are read into memory, its queries update them."""
+        with open(os.path.join(folder, "roadmap.json")) as f:
+            header = json.load(f)
+        # plain ndarray views of the memory maps, the memmap subclass is slow to slice one row at a time
+        arrays = {name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="r" if mmap else None).view(np.ndarray)
+                  for name in _ARRAYS}
+        status = None
+        if header.get("lazy"):
+            arrays["weights"] = np.array(arrays["weights"])
+            status = np.load(os.path.join(folder, "status.npy"))
+        start = arrays["obstacle_start"]
+        vertices = [tuple(vertex) for vertex in np.asarray(arrays["obstacle_vertices"]).tolist()]
+        obstacles = tuple(tuple(vertices[start[ii]:start[ii + 1]]) for ii in range(len(start) - 1))
+        limits = tuple(tuple(limit) for limit in np.asarray(arrays["limits"]).tolist())
+        return cls(arrays["nodes"], arrays["indptr"], arrays["indices"], arrays["weights"],
+                   obstacles, limits, header["kind"], header["k"], status)
+
+    def _candidates(self, points):
+        """ (M, C) array with the roadmap nodes that each query point tries to connect to"""
+        if self.kind == "visibility":
+            return np.broadcast_to(np.arange(len(self.nodes)), (len(points), len(self.nodes)))
+        if self._tree is None:
+            self._tree = cKDTree(self.nodes)
+        # a few extra candidates in case the nearest ones are hidden behind an obstacle
+        _, candidates = self._tree.query(points, k=min(4 * self.k, len(self.nodes)))
+        return candidates.reshape(len(points), -1)
+
+    def _connect(self, point):
+        """ Returns the (node, distance) pairs of the collision free edges from point to the roadmap"""
+        return self._connect_many([point])[0]
+
+    def _connect_many(self, points):
+        """ Same as `_connect` for an (M, 2) array of points, checking all their edges in one batch"""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        candidates = self._candidates(points)
+        segments = np.stack([np.repeat(points, candidates.shape[1], axis=0), self.nodes[candidates.ravel()]], axis=1)
+        free = ~self.index.segments_intersect(segments).reshape(candidates.shape)
+        distances = np.linalg.norm(segments[:, 1] - segments[:, 0], axis=1).reshape(candidates.shape)
+        if self.kind == "prm":
+            # the k closest free candidates, they are sorted by distance
+            free &= np.cumsum(free, axis=1) <= self.k
+        return [list(zip(candidates[ii, free[ii]].tolist(), distances[ii, free[ii]].tolist()))
+                for ii in range(len(points))]
+
+    def _row_entries(self, nodes):
+        """ (owner, entry) arrays with the position in the CSR arrays of every edge out of each of the nodes"""
+        counts = self.indptr[nodes + 1] - self.indptr[nodes]
+        owner = np.repeat(np.arange(len(nodes)), counts)
+        offsets = np.arange(owner.size) - np.repeat(np.cumsum(counts) - counts, counts)
+        return owner, np.repeat(self.indptr[nodes], counts) + offsets
+
+    def _find(self, a, b):
+        """ Positions of the edges from the nodes a to the nodes b in the CSR arrays"""
+        owner, entries = self._row_entries(a)
+        match = self.indices[entries] == b[owner]
+        found = np.empty(len(a), dtype=np.int64)
+        found[owner[match]] = entries[match]
+        return found
+
+    def _check(self, entries):
+        """ Checks the unknown edges among the CSR entries in one batch and marks them free or blocked in both
+            directions. Returns the indices of the obstacles that block them."""
+        entries = np.unique(entries[self.status[entries] == UNKNOWN])
+        if len(entries) == 0:
+            return np.zeros(0, dtype=np.int64)
+        source = np.searchsorted(self.indptr, entries, side="right") - 1
+        target = self.indices[entries]
+        blocked, first_edge = self.index.segments_intersect(self.nodes[np.column_stack([source, target])],
+                                                            return_edge=True)
+        both = np.concatenate([entries, self._find(target, source)])
+        self.status[both] = np.tile(np.where(blocked, BLOCKED, FREE), 2)
+        self.weights[both[np.tile(blocked, 2)]] = np.inf
+        instrumentation.count("lazy_prm.edge_checks", len(entries))
+        instrumentation.count("lazy_prm.blocked", int(blocked.sum()))
+        return np.unique(self.index.edge_obstacle[first_edge[blocked]])
+
+    def _around(self, obstacles):
+        """ CSR entries of the edges whose bounding box overlaps the one of any of the obstacles"""
+        if self._tree is None:
+            self._tree = cKDTree(self.nodes)
+        if self._longest is None:
+            # the blocked edges have an infinite weight, they are never longer than the roadmap edges
+            self._longest = float(np.max(self.weights, where=np.isfinite(self.weights), initial=0.0))
+        boxes = [np.array(self.obstacles[obstacle], dtype=float) for obstacle in obstacles.tolist()]
+        lower = np.array([vertices.min(axis=0) for vertices in boxes])
+        upper = np.array([vertices.max(axis=0) for vertices in boxes])
+        # an edge that reaches the box has an end node closer to its center than half its diagonal plus the edge
+        near = self._tree.query_ball_point((lower + upper) / 2,
+                                           np.linalg.norm(upper - lower, axis=1) / 2 + self._longest)
+        box = np.repeat(np.arange(len(boxes)), [len(nodes) for nodes in near])
+        nodes = np.concatenate([np.asarray(nodes, dtype=np.int64) for nodes in near])
+        owner, entries = self._row_entries(nodes)
+        # both end nodes of such an edge are near the box, keep it once from its lowest node
+        keep = (self.status[entries] == UNKNOWN) & (nodes[owner] < self.indices[entries])
+        owner, entries, box = owner[keep], entries[keep], box[owner[keep]]
+        start, end = self.nodes[nodes[owner]], self.nodes[self.indices[entries]]
+        overlap = np.all(np.minimum(start, end) <= upper[box], axis=1) & np.all(np.maximum(start, end) >= lower[box], axis=1)
+        return entries[overlap]
+
+    def _validate(self, paths):
+        """ Checks the edges of the paths (lists of node indices, the query points past the roadmap nodes are
+            skipped) and returns True if they are all free.
+            When edges collide, the next search would try the other edges that cross the same obstacles one
+            path at a time, and each search costs much more than a batch of checks, so all the edges around
+            these obstacles are checked in the same round."""
+        n_nodes = len(self.nodes)
+        a, b = (np.array([node for nodes in paths for node in side(nodes)], dtype=np.int64)
+                for side in (lambda nodes: nodes[:-1], lambda nodes: nodes[1:]))
+        inside = (a < n_nodes) & (b < n_nodes)
+        hit = self._check(self._find(a[inside], b[inside]))
+        if len(hit) == 0:
+            return True
+        self._check(self._around(hit))
+        return False
+
+    def query(self, p0, pf):
+        """ Shortest path from p0 to pf through the roadmap.
+
+        Returns:
+            distance: length of the path, inf if there is no path.
+            path: list of (x, y) points from p0 to pf, empty if there is no path.
+        """
+        p0, pf = np.asarray(p0, dtype=float), np.asarray(pf, dtype=float)
+        n_nodes = len(self.nodes)
+        start, end = n_nodes, n_nodes + 1
+
+        # p0 and pf are extra nodes only connected to the roadmap through the overlay edges
+        overlay = {start: self._connect(p0), end: []}
+        for node, distance in self._connect(pf):
+            overlay[end].append((node, distance))
+            overlay.setdefault(node, []).append((end, distance))
+        if not self.index.segments_intersect([(p0, pf)])[0]:
+            overlay[start].append((end, float(np.linalg.norm(pf - p0))))
+
+        coords = np.vstack([self.nodes, p0, pf])
+        while True:
+            result = dijkstra_csr(self.indptr, self.indices, self.weights, start, end, coords=coords, overlay=overlay)
+            if result is None:
+                return float("inf"), []
+            distance, predecessor = result
+            nodes = path_from_predecessors(predecessor, end)
+            # a lazy roadmap searches again when an edge of the path collides
+            if not self.lazy or self._validate([nodes]):
+                break
+        path = [tuple(coords[node].tolist()) for node in nodes]
+        return float(distance[end]), path
+
+    def query_many(self, p0, goals):
+        """ Shortest paths from p0 to each of the goals with a single search.
+
+        The search builds the whole shortest path tree from p0 instead of stopping at one goal, so it is
+        faster than calling `query` for each goal as soon as a few goals share the same start.
+
+        Returns:
+            list with the (distance, path) of each goal, like `query`.
+        """
+        p0 = np.asarray(p0, dtype=float)
+        goals = np.asarray(goals, dtype=float).reshape(-1, 2)
+        n_nodes = len(self.nodes)
+        start, ends = n_nodes, n_nodes + 1 + np.arange(len(goals))
+
+        # the goals are extra nodes that can be reached but are never expanded, as the end node of `query`
+        connections = self._connect_many(np.vstack([p0, goals]))
+        overlay = {start: connections[0]}
+        for end, goal_connections in zip(ends.tolist(), connections[1:]):
+            overlay[end] = []
+            for node, distance in goal_connections:
+                overlay.setdefault(node, []).append((end, distance))
+        direct = ~self.index.segments_intersect(np.stack([np.broadcast_to(p0, goals.shape), goals], axis=1))
+        for end, goal in zip(ends[direct].tolist(), goals[direct]):
+            overlay[start].append((end, float(np.linalg.norm(goal - p0))))
+
+        coords = np.vstack([self.nodes, p0, goals])
+        while True:
+            distance, predecessor = dijkstra_csr(self.indptr, self.indices, self.weights, start, None, overlay=overlay)
+            if not self.lazy or self._validate([path_from_predecessors(predecessor, end) for end in ends.tolist()
+                                                if not np.isinf(distance[end])]):
+                break
+        results = []
+        for end in ends.tolist():
+            if np.isinf(distance[end]):
+                results.append((float("inf"), []))
+            else:
+                path = [tuple(coords[node].tolist()) for node in path_from_predecessors(predecessor, end)]
+                results.append((float(distance[end]), path))
+        return results
@@ -0,0 +1,28 @@
+import numpy as np
+
+from collision import ObstacleIndex
+from path_smoothing import downsample, postprocess, shortcut_greedy, shortcut_random, smooth_spline
+
+OBSTACLES = (((3, 3), (3, 4), (5, 4), (5, 3)), ((7, 2), (7, 4), (8, 2)))
+
+
+def test_short_paths_are_returned_unchanged():
+    index = ObstacleIndex(OBSTACLES)
+    for path in ([], [(1.0, 1.0)]):
+        assert shortcut_greedy(path, index) == list(range(len(path)))
+        assert downsample(path, index) == list(range(len(path)))
+        assert len(shortcut_random(path, index)) == len(path)
+        for kwargs in ({}, {"shortcut": "random"}, {"tolerance": 0.05}, {"spline": True}):
+            smoothed, report = postprocess(path, OBSTACLES, **kwargs)
+            assert smoothed == path
+            assert report["waypoints_out"] == len(path)
+
+
+def test_spline_keeps_the_end_points():
+    index = ObstacleIndex(OBSTACLES)
+    p0, pf = (1.1, 1.3), (9.7, 4.1)
+    samples = smooth_spline([p0, (2.2, 5.1), (6.3, 5.2), pf], index)
+    assert tuple(samples[0]) == p0 and tuple(samples[-1]) == pf
+    smoothed, report = postprocess([p0, (2.2, 5.1), (6.3, 5.2), pf], OBSTACLES, shortcut=None, spline=True)
+    assert report["spline"] and smoothed[0] == p0 and smoothed[-1] == pf
+    assert np.all(~index.segments_intersect(np.stack([smoothed[:-1], smoothed[1:]], axis=1)))
@@ -2,7 +2,23 @@
 """
 import numpy as np
 
-def visibility_graph(p0, pf, obstacles, limits):
+import instrumentation
+from collision import ObstacleIndex
+from graph import Graph
+from parallel import segments_intersect_parallel
+
+def visibility_graph(p0, pf, obstacles, limits, index=None, method="naive", workers=1, as_graph=False):
+    """ Builds the visibility graph between the obstacle vertices, the limits, p0 and pf.
+        index: optional prebuilt `collision.ObstacleIndex` of the obstacles, to reuse it across calls
+        method: "naive" checks every pair of vertices against the obstacles in a batch,
+                "sweep" uses Lee's rotational plane sweep, O(n^2 log n) expected. Both give the same graph.
+                The sweep runs in pure Python and is slower than the naive batch on the maps of
+                `benchmarks.bench_visibility_graph` (up to 200 obstacles), keep the naive default.
+        workers: number of processes checking the candidate pairs of the "naive" method, None for one per CPU
+        as_graph: return a `graph.Graph` instead of a dictionary
+    """
+    if index is None:
+        index = ObstacleIndex(obstacles)
     graph = {}
 
     # Add vertices to the graph
@@ -16,47 +32,299 @@ def visibility_graph(p0, pf, obstacles, limits):
     graph[p0] = {}
     graph[pf] = {}
 
-    # Add edges to the graph
-    visited = set() 
-    for point in graph:
-        for other_point in graph:
-            if point in obs_id and other_point in obs_id and obs_id[point] == obs_id[other_point]:
-                    continue
-            elif point != other_point and other_point not in visited:
-                if not is_line_intersecting(point, other_point, obstacles):
-                    distance = np.linalg.norm(np.array(point) - np.array(other_point))
-                    graph[point][other_point] = graph[other_point][point] = distance 
-        visited.add(point)
-    
+    # Add edges to the graph, checking all the candidate pairs in one batch
+    nodes = list(graph)
+    obstacle_of = np.array([obs_id.get(node, -1) for node in nodes])
+    with instrumentation.timer("visibility_graph.edges"):
+        if method == "sweep":
+            i, j, distances = visibility_edges_sweep(np.array(nodes, dtype=float), obstacle_of, index.edges)
+        elif method == "naive":
+            i, j, distances = visibility_edges(np.array(nodes, dtype=float), obstacle_of, index, workers)
+        else:
+            raise ValueError(f"Unknown visibility graph method: {method}")
+    instrumentation.count("graph.nodes", len(nodes))
+    instrumentation.count("graph.edges", len(i))
+    if as_graph:
+        return Graph.from_edges(np.array(nodes, dtype=float), i, j, distances)
+    for a, b, distance in zip(i.tolist(), j.tolist(), distances.tolist()):
+        graph[nodes[a]][nodes[b]] = graph[nodes[b]][nodes[a]] = distance
+
     return graph
 
-def is_line_intersecting(p1, p2, obstacles):
-    """
-    Checks if the line between two points intersects any of the obstacles,
-    defined by a list of the vertices in a convex polygon.
-    Returns True if the line intersects an obstacle, False otherwise.
-    
-    Parameters:
-        p1 (list): List representing the first point [x, y].
-        p2 (list): List representing the second point [x, y].
-        obstacles (list): List of obstacles, each obstacle is represented
-                          by a list of vertices [[x1, y1], [x2, y2], ...].
-    
+def visibility_edges(coords, obstacle_of, index, workers=1):
+    """ Finds every pair of vertices that can see each other.
+        coords: (N, 2) array with the vertices
+        obstacle_of: (N,) array with the obstacle each vertex belongs to, -1 for the free points.
+                     Two vertices of the same obstacle are never connected.
+        index: `collision.ObstacleIndex` of the obstacles
+        workers: number of processes for the collision checks, see `parallel.segments_intersect_parallel`
+
     Returns:
-        bool: True if the line intersects an obstacle, False otherwise.
+        i, j: arrays with the vertex indices of each edge (i < j).
+        distances: array with the length of each edge.
+    """
+    i, j = np.triu_indices(len(coords), k=1)
+    keep = (obstacle_of[i] < 0) | (obstacle_of[i] != obstacle_of[j])
+    i, j = i[keep], j[keep]
+    segments = np.stack([coords[i], coords[j]], axis=1)
+    if workers == 1:
+        free = ~index.segments_intersect(segments)
+    else:
+        free = ~segments_intersect_parallel(segments, index.obstacles, workers)
+    distances = np.linalg.norm(segments[:, 0] - segments[:, 1], axis=1)
+    return i[free], j[free], distances[free]
+
+def visibility_edges_sweep(coords, obstacle_of, edges):
+    """ Same as `visibility_edges`, with Lee's rotational plane sweep around each vertex.
 
-    Source: Github Copilot
+        The vertices are visited in angular order around each vertex p, keeping the obstacle edges
+        crossed by the current ray sorted by distance to p in a treap (`_ActiveEdges`), so only the closest
+        ones need to be checked.
+        The final check uses the same test as `collision.segments_intersect` on the pair ordered as in
+        `visibility_edges`, so both functions return the same edges, also for collinear vertices.
+        edges: (E, 2, 2) array with the obstacle edges, their end points must be vertices in coords.
     """
+    coords_list = [tuple(vertex) for vertex in coords.tolist()]
+    node_of = {}
+    for ii, vertex in enumerate(coords_list):
+        node_of.setdefault(vertex, ii)
+    edge_list = [(tuple(a), tuple(b)) for a, b in edges.tolist()]
+    edge_nodes = np.array([(node_of[a], node_of[b]) for a, b in edge_list], dtype=np.int64).reshape(-1, 2)
+    incident = [[] for _ in coords_list]
+    for e, (a, b) in enumerate(edge_nodes.tolist()):
+        incident[a].append(e)
+        incident[b].append(e)
+
+    priority = _edge_priorities(len(edge_list))
+
+    i_list, j_list = [], []
+    for p in range(len(coords_list)):
+        visible = _sweep(p, coords, coords_list, edges, edge_list, edge_nodes, incident, priority)
+        for w in visible:
+            if w > p and (obstacle_of[p] < 0 or obstacle_of[p] != obstacle_of[w]):
+                i_list.append(p)
+                j_list.append(w)
+    i, j = np.array(i_list, dtype=np.int64), np.array(j_list, dtype=np.int64)
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    return i, j, np.linalg.norm(coords[i] - coords[j], axis=1)
+
+
+def _crosses(p1, p2, edge):
+    """ Scalar version of `collision.pairwise_intersect` for one segment and one edge"""
+    p3, p4 = edge
+    if p1 == p3 or p1 == p4 or p2 == p3 or p2 == p4:
+        return False
     def ccw(A, B, C):
         return (C[1]-A[1]) * (B[0]-A[0]) > (B[1]-A[1]) * (C[0]-A[0])
-    
-    for obstacle in obstacles:
-        for i in range(len(obstacle)):
-            p3 = obstacle[i]
-            p4 = obstacle[(i + 1) % len(obstacle)]
-            if p1 == p3 or p1 == p4 or p2 == p3 or p2 == p4:
-                continue
+    return ccw(p1, p3, p4) != ccw(p2, p3, p4) and ccw(p1, p2, p3) != ccw(p1, p2, p4)
+
+
+class _ActiveEdges:
+    """ Edges crossed by the sweep ray, ordered from the closest to p.
+
+        They are kept in a treap (a binary search tree balanced by pseudo-random priorities) over the edge
+        indices, so inserting or removing an edge costs O(log n) comparisons and checking if an edge is
+        active costs O(1). The order of the active edges along the ray does not change while they are active,
+        only the comparison of a new edge depends on the direction of the ray, it is given to `insert`.
+    """
+
+    def __init__(self, priority, ordered):
+        """ priority: list with the treap priority of each edge, see `_edge_priorities`
+            ordered: edges crossed by the initial ray, sorted from the closest to p
+        """
+        n_edges = len(priority)
+        self.priority = priority
+        self.left = [-1] * n_edges
+        self.right = [-1] * n_edges
+        self.parent = [-1] * n_edges
+        self.active = [False] * n_edges
+        # Cartesian tree of the edges already sorted along the ray
+        stack = []
+        for e in ordered:
+            self.active[e] = True
+            last = -1
+            while stack and priority[stack[-1]] > priority[e]:
+                last = stack.pop()
+            if last >= 0:
+                self.left[e], self.parent[last] = last, e
+            if stack:
+                self.right[stack[-1]], self.parent[e] = e, stack[-1]
+            stack.append(e)
+        self.root = stack[0] if stack else -1
+
+    def _rotate_up(self, x):
+        """ Rotates x above its parent, keeping the order of the tree"""
+        left, right, parent = self.left, self.right, self.parent
+        p = parent[x]
+        g = parent[p]
+        if left[p] == x:
+            left[p] = right[x]
+            if right[x] >= 0:
+                parent[right[x]] = p
+            right[x] = p
+        else:
+            right[p] = left[x]
+            if left[x] >= 0:
+                parent[left[x]] = p
+            left[x] = p
+        parent[p], parent[x] = x, g
+        if g < 0:
+            self.root = x
+        elif left[g] == p:
+            left[g] = x
+        else:
+            right[g] = x
+
+    def insert(self, e, closer, dx, dy):
+        """ Inserts edge e before the first active edge other for which closer(e, other, dx, dy) is True"""
+        node, parent, go_left = self.root, -1, False
+        while node >= 0:
+            parent = node
+            go_left = closer(e, node, dx, dy)
+            node = self.left[node] if go_left else self.right[node]
+        self.left[e] = self.right[e] = -1
+        self.parent[e] = parent
+        self.active[e] = True
+        if parent < 0:
+            self.root = e
+        elif go_left:
+            self.left[parent] = e
+        else:
+            self.right[parent] = e
+        priority = self.priority
+        while self.parent[e] >= 0 and priority[e] < priority[self.parent[e]]:
+            self._rotate_up(e)
+
+    def remove(self, e):
+        """ Removes the active edge e"""
+        left, right, priority = self.left, self.right, self.priority
+        # rotate e down to a leaf, then detach it
+        while left[e] >= 0 or right[e] >= 0:
+            if right[e] < 0 or (left[e] >= 0 and priority[left[e]] < priority[right[e]]):
+                self._rotate_up(left[e])
+            else:
+                self._rotate_up(right[e])
+        p = self.parent[e]
+        if p < 0:
+            self.root = -1
+        elif left[p] == e:
+            left[p] = -1
+        else:
+            right[p] = -1
+        self.active[e] = False
+
+    def __iter__(self):
+        """ Active edges from the closest to p"""
+        left, right, parent = self.left, self.right, self.parent
+        node = self.root
+        if node < 0:
+            return
+        while left[node] >= 0:
+            node = left[node]
+        while node >= 0:
+            yield node
+            if right[node] >= 0:
+                node = right[node]
+                while left[node] >= 0:
+                    node = left[node]
             else:
-                if ccw(p1, p3, p4) != ccw(p2, p3, p4) and ccw(p1, p2, p3) != ccw(p1, p2, p4):
-                    return True
-    return False
+                while parent[node] >= 0 and right[parent[node]] == node:
+                    node = parent[node]
+                node = parent[node]
+
+
+def _edge_priorities(n_edges):
+    """ Pseudo-random treap priorities of the edges of `_ActiveEdges`, fixed so the sweeps are deterministic"""
+    return ((np.arange(n_edges, dtype=np.uint64) * 2654435761) & 0xFFFFFFFF).tolist()
+
+
+def _sweep(p, coords, coords_list, edges, edge_list, edge_nodes, incident, priority):
+    """ Returns the vertices visible from vertex p, see `visibility_edges_sweep`"""
+    px, py = coords_list[p]
+    relative = coords - coords[p]
+    angle = np.arctan2(relative[:, 1], relative[:, 0]) % (2 * np.pi)
+    squared_distance = np.einsum("ij,ij->i", relative, relative)
+    order = np.lexsort((squared_distance, angle))
+    order = [w for w in order.tolist() if coords_list[w] != (px, py)]
+    squared_distance = squared_distance.tolist()
+
+    # orientation of each edge around p: > 0 the edge is entered (inserted) at its first vertex
+    # and left at its second one, < 0 the other way around, 0 the edge is aligned with p
+    a, b = edges[:, 0] - coords[p], edges[:, 1] - coords[p]
+    turn = a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0]
+    enter = np.where(turn > 0, edge_nodes[:, 0], np.where(turn < 0, edge_nodes[:, 1], -1)).tolist()
+    leave = np.where(turn > 0, edge_nodes[:, 1], np.where(turn < 0, edge_nodes[:, 0], -1)).tolist()
+    touches_p = np.any(np.all(edges == coords[p], axis=2), axis=1)
+    # edges with p in their interior can block any direction, they are checked for every vertex
+    through_p = np.flatnonzero((turn == 0) & (np.einsum("ij,ij->i", a, b) < 0) & ~touches_p).tolist()
+
+    def distance(e, dx, dy):
+        """ Distance along the ray p + t (dx, dy) to edge e, in units of the ray vector"""
+        (ax, ay), (bx, by) = edge_list[e]
+        ex, ey = bx - ax, by - ay
+        return ((ax - px) * ey - (ay - py) * ex) / (dx * ey - dy * ex)
+
+    def closer(e, other, dx, dy):
+        """ True if the new edge e, starting on the ray, is in front of the active edge other"""
+        t_e, t_other = distance(e, dx, dy), distance(other, dx, dy)
+        if abs(t_e - t_other) > 1e-12 * max(1.0, abs(t_e)):
+            return t_e < t_other
+        # both edges meet on the ray: e is in front if the end of other is behind the line of e
+        (vx, vy), (ux, uy) = coords_list[enter[e]], coords_list[leave[e]]
+        (ox, oy) = coords_list[leave[other]]
+        side_other = (ux - vx) * (oy - vy) - (uy - vy) * (ox - vx)
+        side_p = (ux - vx) * (py - vy) - (uy - vy) * (px - vx)
+        return side_other * side_p < 0
+
+    # edges crossing the initial ray, which points along +x
+    crossing = ((edges[:, 0, 1] - py) * (edges[:, 1, 1] - py) < 0) & ~touches_p
+    candidates = np.flatnonzero(crossing)
+    t = edges[candidates, 0, 0] + (py - edges[candidates, 0, 1]) * (
+        (edges[candidates, 1, 0] - edges[candidates, 0, 0]) / (edges[candidates, 1, 1] - edges[candidates, 0, 1]))
+    active = _ActiveEdges(priority, candidates[t > px][np.argsort(t[t > px], kind="stable")].tolist())
+
+    visible = []
+    start = 0
+    while start < len(order):
+        # group the vertices on the same ray from p, sorted by distance. The tolerance keeps together
+        # vertices that the rounding of the angles or of the crossing test could put on either side
+        wx, wy = coords_list[order[start]][0] - px, coords_list[order[start]][1] - py
+        stop = start + 1
+        while stop < len(order):
+            vx, vy = coords_list[order[stop]][0] - px, coords_list[order[stop]][1] - py
+            if abs(wx * vy - wy * vx) > 1e-9 * np.hypot(wx, wy) * np.hypot(vx, vy) or wx * vx + wy * vy < 0:
+                break
+            stop += 1
+        group = sorted(order[start:stop], key=squared_distance.__getitem__)
+        start = stop
+
+        for v in group:
+            for e in incident[v]:
+                if leave[e] == v and active.active[e]:
+                    active.remove(e)
+
+        behind = list(through_p)
+        for w in group:
+            # the pair is tested in the same order as the batch version, the test is not symmetric
+            p1, p2 = (coords_list[p], coords_list[w]) if p < w else (coords_list[w], coords_list[p])
+            blocked = any(_crosses(p1, p2, edge_list[e]) for e in behind)
+            if not blocked:
+                dx, dy = coords_list[w][0] - px, coords_list[w][1] - py
+                for e in active:
+                    if distance(e, dx, dy) > 1 + 1e-9:
+                        break
+                    if _crosses(p1, p2, edge_list[e]):
+                        blocked = True
+                        break
+            if not blocked:
+                visible.append(w)
+            # the edges touching the ray at w can block the vertices further away on the same ray
+            behind.extend(e for e in incident[w] if not touches_p[e])
+
+        for v in group:
+            dx, dy = coords_list[v][0] - px, coords_list[v][1] - py
+            for e in incident[v]:
+                if enter[e] == v and not touches_p[e]:
+                    active.insert(e, closer, dx, dy)
+    return visible